@@ -0,0 +1,228 @@
+from collections import Counter
+from datetime import date
+
+import numpy as np
+from sqlalchemy import Date, DateTime, bindparam, text
+
+from partitions import month_start
+
+
+# Show volume per month, overall, per venue city and per artist genre, kept
+# in `show_rollups` by adding or subtracting each show as it is listed or
+# deleted, in the same transaction. Archiving moves shows between tables
+# without touching their counts. Dashboards read a window of rollup rows and
+# derive growth and shares from them with array arithmetic, so they never
+# scan `shows` and cost the same however much history has built up.
+#
+# A show counts towards its venue's current city and each of its artist's
+# current genres; editing those moves the record's shows between labels.
+
+VENUE_ROLLUP_FIELDS = ('city', 'state')
+ARTIST_ROLLUP_FIELDS = ('genres',)
+
+UPSERT = text(
+    'INSERT INTO show_rollups (dimension, label, month, count) VALUES (:dimension, :label, :month, :count) '
+    'ON CONFLICT (dimension, label, month) DO UPDATE SET count = show_rollups.count + excluded.count'
+)
+INCREMENT = text(
+    'UPDATE show_rollups SET count = count + :count '
+    'WHERE dimension = :dimension AND label = :label AND month = :month'
+)
+INSERT = text(
+    'INSERT INTO show_rollups (dimension, label, month, count) VALUES (:dimension, :label, :month, :count)'
+)
+
+
+def previous_month(month):
+    return date(month.year - (month.month == 1), (month.month - 2) % 12 + 1, 1)
+
+
+def city_label(city, state):
+    return '%s, %s' % (city, state)
+
+
+def genre_labels(genres):
+    return sorted({genre.strip() for genre in (genres or '').split(',') if genre.strip()})
+
+
+def rollup_deltas(shows, sign=1):
+    """Counts per (dimension, label, month) of (start_time, city, state, genres) rows, times `sign`."""
+    deltas = Counter()
+    for start_time, city, state, genres in shows:
+        month = month_start(start_time)
+        deltas['all', '', month] += sign
+        deltas['city', city_label(city, state), month] += sign
+        for genre in genre_labels(genres):
+            deltas['genre', genre, month] += sign
+    return deltas
+
+
+def apply_deltas(session, deltas):
+    # rows are written in key order so concurrent transactions lock them in
+    # the same order and can't deadlock each other
+    rows = [
+        {'dimension': dimension, 'label': label, 'month': month, 'count': count}
+        for (dimension, label, month), count in sorted(deltas.items()) if count
+    ]
+    if not rows:
+        return
+    if session.get_bind().dialect.name in ('postgresql', 'sqlite'):
+        session.execute(UPSERT, rows)
+        return
+    for row in rows:
+        if session.execute(INCREMENT, row).rowcount == 0:
+            session.execute(INSERT, row)
+
+
+def show_attributes(session, shows):
+    """Turns (start_time, artist_id, venue_id) shows into (start_time, city, state, genres) rows."""
+    shows = list(shows)
+    if not shows:
+        return []
+    venues = {
+        venue_id: (city, state) for venue_id, city, state in session.execute(
+            text('SELECT id, city, state FROM venues WHERE id IN :ids').bindparams(bindparam('ids', expanding=True)),
+            {'ids': sorted({venue_id for _, _, venue_id in shows})}
+        )
+    }
+    artists = dict(session.execute(
+        text('SELECT id, genres FROM artists WHERE id IN :ids').bindparams(bindparam('ids', expanding=True)),
+        {'ids': sorted({artist_id for _, artist_id, _ in shows})}
+    ).fetchall())
+    return [
+        (start_time,) + venues[venue_id] + (artists[artist_id],)
+        for start_time, artist_id, venue_id in shows
+    ]
+
+
+def record_shows(session, shows, sign=1):
+    """Adds (sign=1) or removes (sign=-1) (start_time, artist_id, venue_id) shows from the rollups."""
+    apply_deltas(session, rollup_deltas(show_attributes(session, shows), sign))
+
+
+def shows_of(session, column, record_id):
+    """The (start_time, artist_id, venue_id) of every hot and archived show of one artist or venue."""
+    if column not in ('artist_id', 'venue_id'):
+        raise ValueError('Unknown show column: %s' % column)
+    query = ' UNION ALL '.join(
+        'SELECT start_time, artist_id, venue_id FROM %s WHERE %s = :id' % (table, column)
+        for table in ('shows', 'shows_archive')
+    )
+    return session.execute(text(query).columns(start_time=DateTime), {'id': record_id}).fetchall()
+
+
+def backfill_rollups(engine):
+    """Rebuilds `show_rollups` from every hot and archived show. Returns the number of shows counted."""
+    with engine.begin() as connection:
+        if engine.dialect.name == 'postgresql':
+            # shows listed meanwhile wait to update their counts until the
+            # rebuilt ones are committed, rather than being lost in the rebuild
+            connection.execute(text('LOCK TABLE show_rollups IN EXCLUSIVE MODE'))
+        deltas = Counter()
+        for table in ('shows', 'shows_archive'):
+            deltas.update(rollup_deltas(connection.execution_options(stream_results=True).execute(text(
+                'SELECT s.start_time, v.city, v.state, a.genres FROM %s s '
+                'JOIN venues v ON v.id = s.venue_id JOIN artists a ON a.id = s.artist_id' % table
+            ).columns(start_time=DateTime))))
+        connection.execute(text('DELETE FROM show_rollups'))
+        rows = [
+            {'dimension': dimension, 'label': label, 'month': month, 'count': count}
+            for (dimension, label, month), count in sorted(deltas.items())
+        ]
+        if rows:
+            connection.execute(INSERT, rows)
+    return sum(count for (dimension, _, _), count in deltas.items() if dimension == 'all')
+
+
+def month_axis(last, months):
+    axis = [month_start(last)]
+    while len(axis) < months:
+        axis.append(previous_month(axis[-1]))
+    return axis[::-1]
+
+
+def load_rollups(session, first, last):
+    return session.execute(text(
+        'SELECT dimension, label, month, count FROM show_rollups '
+        'WHERE month >= :first AND month <= :last AND count != 0'
+    ).columns(month=Date), {'first': first, 'last': last}).fetchall()
+
+
+def rollup_matrix(rows, dimension, month_index):
+    """Labels of `dimension` and a labels x months array of their counts."""
+    labels = sorted({label for row_dimension, label, _, _ in rows if row_dimension == dimension})
+    label_index = {label: i for i, label in enumerate(labels)}
+    counts = np.zeros((len(labels), len(month_index)), dtype=np.int64)
+    cells = [
+        (label_index[label], month_index[month], count)
+        for row_dimension, label, month, count in rows if row_dimension == dimension
+    ]
+    if cells:
+        rows_at, columns_at, values = np.array(cells, dtype=np.int64).T
+        counts[rows_at, columns_at] = values
+    return labels, counts
+
+
+def ratio(numerator, denominator):
+    """numerator / denominator, elementwise, with NaN where the denominator is 0."""
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float))
+    return np.divide(numerator, denominator, out=np.full(numerator.shape, np.nan), where=denominator != 0)
+
+
+def as_list(values, digits=4):
+    return [None if np.isnan(value) else round(float(value), digits) for value in values]
+
+
+def dashboard(session, last, months, top_cities):
+    """Show volume for the `months` months up to `last`, with growth, busiest cities and genre shares.
+
+    Genre shares are of genre listings: a show by an artist with two genres
+    counts once towards each.
+    """
+    # a year before the window is read too, for year-over-year growth
+    axis = month_axis(last, months + 12)
+    month_index = {month: i for i, month in enumerate(axis)}
+    rows = load_rollups(session, axis[0], axis[-1])
+
+    _, totals = rollup_matrix(rows, 'all', month_index)
+    totals = totals[0] if len(totals) else np.zeros(len(axis), dtype=np.int64)
+    month_over_month = ratio(np.diff(totals), totals[:-1])[-months:]
+    year_over_year = ratio(totals[12:] - totals[:-12], totals[:-12])
+    window_total = totals[-months:].sum()
+
+    cities, city_counts = rollup_matrix(rows, 'city', month_index)
+    city_counts = city_counts[:, -months:]
+    city_totals = city_counts.sum(axis=1)
+    busiest = [i for i in np.argsort(-city_totals, kind='stable')[:top_cities] if city_totals[i]]
+
+    genres, genre_counts = rollup_matrix(rows, 'genre', month_index)
+    genre_counts = genre_counts[:, -months:]
+    genre_totals = genre_counts.sum(axis=1)
+    genre_shares = ratio(genre_totals, genre_totals.sum())
+    monthly_genre_shares = ratio(genre_counts, genre_counts.sum(axis=0))
+
+    return {
+        'months': [month.strftime('%Y-%m') for month in axis[-months:]],
+        'shows': totals[-months:].tolist(),
+        'total': int(window_total),
+        'month_over_month': as_list(month_over_month),
+        'year_over_year': as_list(year_over_year),
+        'top_cities': [
+            {
+                'city': cities[i],
+                'shows': int(city_totals[i]),
+                'share': as_list(ratio(city_totals[i:i + 1], window_total))[0],
+                'series': city_counts[i].tolist(),
+            }
+            for i in busiest
+        ],
+        'genres': [
+            {
+                'genre': genres[i],
+                'shows': int(genre_totals[i]),
+                'share': as_list(genre_shares[i:i + 1])[0],
+                'series': as_list(monthly_genre_shares[i]),
+            }
+            for i in np.argsort(-genre_totals, kind='stable') if genre_totals[i]
+        ],
+    }
@@ -1,15 +1,25 @@
-import logging
+import json
+import math
 from datetime import datetime
-from logging import FileHandler, Formatter
 import string
 import babel
 import dateutil.parser
-from flask import Flask, flash, redirect, render_template, request, url_for
+from flask import Flask, Response, abort, flash, jsonify, redirect, render_template, request, send_file, url_for
 from flask_migrate import Migrate
 from flask_moment import Moment
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from forms import *
-from models import db, Venue, Artist, Show
+from models import db, Venue, Artist, Show, ArchivedShow
+from replicas import ReplicaRouter, read_only
+from geo import VenueIndex, city_centroid
+from matchmaking import Matchmaker
+from ratelimit import AdmissionControl, limit_class
+from thumbnails import FetchError, FileFetcher, ThumbnailCache
+from metrics import RequestMetrics, setup_logging
+from partitions import archive_cutoff, maintain_shows
+from profiling import RequestProfiler
+from analytics import ARTIST_ROLLUP_FIELDS, VENUE_ROLLUP_FIELDS, backfill_rollups, dashboard, record_shows, shows_of
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -18,7 +28,24 @@ from models import db, Venue, Artist, Show
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
+# optional overrides, e.g. relaxed limits for a load test
+app.config.from_envvar('FYYUR_SETTINGS', silent=True)
+if app.config.get('TRUSTED_PROXIES'):
+  app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
 db.init_app(app)
+# registered first so requests turned away by admission control are still measured
+request_metrics = RequestMetrics(app)
+replicas = ReplicaRouter(app)
+profiler = RequestProfiler(app)
+venue_index = VenueIndex()
+matchmaker = Matchmaker()
+admission = AdmissionControl(app)
+thumbnail_cache = ThumbnailCache(
+  app.config['THUMBNAIL_DIR'],
+  app.config['THUMBNAIL_CACHE_BYTES'],
+  fetcher=FileFetcher(app.config['THUMBNAIL_FETCHER_FILE']) if app.config.get('THUMBNAIL_FETCHER_FILE') else None,
+  failure_ttl=app.config.get('THUMBNAIL_RETRY_SECONDS', 60)
+)
 
 # connect to a local postgresql database
 migrate = Migrate(app, db)
@@ -40,6 +67,14 @@ def format_datetime(value, format='medium'):
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+def thumbnail_url(image_link, size='tile'):
+  # only http(s) images are proxied; anything else is left as it was
+  if not image_link or not image_link.startswith(('http://', 'https://')):
+    return image_link
+  return url_for('thumbnail', size=size, url=image_link)
+
+app.jinja_env.filters['thumbnail'] = thumbnail_url
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -56,6 +91,14 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
+def past_shows_for(hot_column, archive_column, id):
+  # past shows live partly in the hot shows table and partly in the archive;
+  # upcoming shows are only ever in the hot one
+  now = datetime.now()
+  hot = db.session.query(Show).filter(hot_column == id).filter(Show.start_time < now).all()
+  archived = db.session.query(ArchivedShow).filter(archive_column == id).all()
+  return sorted(archived + hot, key=lambda show: show.start_time)
+
 @app.route('/venues')
 def venues():
   # replace with real venues data.
@@ -83,6 +126,8 @@ def venues():
   return render_template('pages/venues.html', areas=data);
 
 @app.route('/venues/search', methods=['POST'])
+@read_only
+@limit_class('search')
 def search_venues():
   # implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
@@ -109,6 +154,50 @@ def search_venues():
     })
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
+NEAR_LIMIT = 100
+
+@app.route('/venues/near')
+@limit_class('search')
+def search_venues_near():
+  # venues within `km` of a point, or the `k` nearest ones when k is given.
+  # the point is either ?lat=&lng= or the centroid of ?city=&state=
+  latitude = request.args.get('lat', type=float)
+  longitude = request.args.get('lng', type=float)
+  if latitude is None or longitude is None:
+    latitude, longitude = city_centroid(request.args.get('city'), request.args.get('state'))
+    origin = '%s, %s' % (request.args.get('city', ''), request.args.get('state', ''))
+  else:
+    origin = '%s, %s' % (latitude, longitude)
+  km = request.args.get('km', 30, type=float)
+  k = request.args.get('k', type=int)
+  # `not x >= 0` also turns away NaN
+  if not km >= 0 or (k is not None and k < 0):
+    abort(400)
+  if latitude is not None and not (abs(latitude) <= 90 and math.isfinite(longitude)):
+    abort(400)
+  # a page never holds the whole catalog: at most NEAR_LIMIT venues, within 500 km
+  km = min(km, 500)
+  k = min(k, NEAR_LIMIT) if k is not None else None
+
+  response = {"count": 0, "data": []}
+  if latitude is not None:
+    venue_index.ensure_loaded(db.session, Venue)
+    if k is not None:
+      matches = venue_index.nearest(latitude, longitude, k)
+      search_term = '%d nearest to %s' % (k, origin)
+    else:
+      matches = venue_index.within(latitude, longitude, km)[:NEAR_LIMIT]
+      search_term = 'within %g km of %s' % (km, origin)
+    names = dict(db.session.query(Venue.id, Venue.name).filter(Venue.id.in_([key for _, key in matches]))) if matches else {}
+    response["data"] = [
+      {'id': key, 'name': names[key], 'distance_km': round(distance, 1)}
+      for distance, key in matches if key in names
+    ]
+    response["count"] = len(response["data"])
+  else:
+    search_term = 'near unknown location %s' % origin
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
+
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
@@ -116,7 +205,7 @@ def show_venue(venue_id):
   
   venue = Venue.query.get(venue_id)
 
-  past_shows_query = db.session.query(Show).join(Venue).filter(Show.venue_id==venue_id).filter(Show.start_time<datetime.now()).all()   
+  past_shows_query = past_shows_for(Show.venue_id, ArchivedShow.venue_id, venue_id)
   past_shows = []
   for show in past_shows_query:
     past_shows.append(
@@ -161,6 +250,24 @@ def show_venue(venue_id):
   
   return render_template('pages/show_venue.html', venue=data)
 
+def match_limit():
+  # ?limit=N best matches, at most 100 so a page never lists every seeker
+  return min(max(request.args.get('limit', 20, type=int), 1), 100)
+
+@app.route('/venues/<int:venue_id>/matches')
+@limit_class('search')
+def venue_matches(venue_id):
+  # artists looking for a venue, ranked by genre overlap, location and recent shows
+  venue = Venue.query.get_or_404(venue_id)
+  matchmaker.ensure_loaded(db.session, Artist, Venue, Show)
+  ranked = matchmaker.artists_for_venue(venue_id, limit=match_limit())
+  names = dict(db.session.query(Artist.id, Artist.name).filter(Artist.id.in_([key for _, key in ranked]))) if ranked else {}
+  matches = [
+    {'id': key, 'name': names[key], 'score': score, 'url': url_for('show_artist', artist_id=key)}
+    for score, key in ranked if key in names
+  ]
+  return render_template('pages/matches.html', name=venue.name, kind='Artists', matches=matches)
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
@@ -193,6 +300,7 @@ def create_venue_submission():
     seeking_description = form.seeking_description.data.strip()
     website = form.website_link.data.strip()
     genres = ",".join(form.genres.data) # need to transform genres to a string before insertion
+    latitude, longitude = city_centroid(city, state)
   
     for char in string.ascii_letters:
       if char in phone:
@@ -212,10 +320,14 @@ def create_venue_submission():
       seeking_talent=seeking_talent,
       seeking_description=seeking_description,
       website_link=website,
-      genres=genres
+      genres=genres,
+      latitude=latitude,
+      longitude=longitude
     )
     db.session.add(venue)
     db.session.commit()
+    venue_index.add(venue.id, latitude, longitude)
+    matchmaker.put_venue(venue.id, genres, city, state, seeking_talent)
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
   except:
     db.session.rollback()
@@ -231,11 +343,15 @@ def delete_venue(venue_id):
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
   try:
     venue = Venue.query.get(venue_id)
-    for show in venue.shows:
+    shows = venue.shows + venue.archived_shows
+    record_shows(db.session, [(show.start_time, show.artist_id, show.venue_id) for show in shows], sign=-1)
+    for show in shows:
       db.session.delete(show)
     
     db.session.delete(venue)
     db.session.commit()
+    venue_index.remove(venue.id)
+    matchmaker.remove_venue(venue.id)
     flash(venue.name + ' was successfully deleted.')
   except:
     db.session.rollback()
@@ -255,6 +371,8 @@ def artists():
   return render_template('pages/artists.html', artists=data)
 
 @app.route('/artists/search', methods=['POST'])
+@read_only
+@limit_class('search')
 def search_artists():
   # implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
@@ -287,7 +405,7 @@ def show_artist(artist_id):
   # replace with real artist data from the artist table, using artist_id
   artist = Artist.query.get(artist_id)
 
-  past_shows_query = db.session.query(Show).join(Artist).filter(Show.artist_id==artist_id).filter(Show.start_time<datetime.now()).all()   
+  past_shows_query = past_shows_for(Show.artist_id, ArchivedShow.artist_id, artist_id)
   past_shows = []
   for show in past_shows_query:
     past_shows.append(
@@ -330,25 +448,112 @@ def show_artist(artist_id):
   }
   return render_template('pages/show_artist.html', artist=data)
 
+@app.route('/artists/<int:artist_id>/matches')
+@limit_class('search')
+def artist_matches(artist_id):
+  # venues looking for talent, ranked by genre overlap, location and recent shows
+  artist = Artist.query.get_or_404(artist_id)
+  matchmaker.ensure_loaded(db.session, Artist, Venue, Show)
+  ranked = matchmaker.venues_for_artist(artist_id, limit=match_limit())
+  names = dict(db.session.query(Venue.id, Venue.name).filter(Venue.id.in_([key for _, key in ranked]))) if ranked else {}
+  matches = [
+    {'id': key, 'name': names[key], 'score': score, 'url': url_for('show_venue', venue_id=key)}
+    for score, key in ranked if key in names
+  ]
+  return render_template('pages/matches.html', name=artist.name, kind='Venues', matches=matches)
+
 #  Update
 #  ----------------------------------------------------------------
+
+ARTIST_FIELDS = (
+  'name', 'city', 'state', 'phone', 'facebook_link', 'website_link',
+  'image_link', 'seeking_venue', 'seeking_description', 'genres'
+)
+VENUE_FIELDS = (
+  'name', 'city', 'state', 'address', 'phone', 'facebook_link', 'website_link',
+  'image_link', 'seeking_talent', 'seeking_description', 'genres'
+)
+
+def populate_edit_form(form, record, fields):
+  # fill the form from the record, and remember the version and column
+  # values it was rendered from so the submission can be diffed against them.
+  # empty columns render as '' so they are snapshotted as '' too.
+  original = {field: getattr(record, field) for field in fields}
+  original = {field: '' if value is None else value for field, value in original.items()}
+  for field, value in original.items():
+    form[field].default = value
+  form.genres.default = record.genres.split(",")
+  form.version.default = record.version
+  form.original.default = json.dumps(original)
+  form.process()
+
+def same_value(field, original, submitted):
+  # genres are submitted in the order of the form's choices, which needn't
+  # be the order they were stored in
+  if field == 'genres':
+    return sorted(original.split(',')) == sorted(submitted.split(','))
+  return original == submitted
+
+def changed_fields(form, fields):
+  # the submitted values, and those that differ from what the edit form
+  # was rendered with
+  submitted = {field: form[field].data for field in fields}
+  submitted['genres'] = ",".join(submitted['genres'])
+  original = json.loads(form.original.data or '{}')
+  changes = {
+    field: value for field, value in submitted.items()
+    if field not in original or not same_value(field, original[field], value)
+  }
+  return submitted, changes
+
+def update_changed_fields(model, record_id, form, fields, derive=None):
+  # writes only the columns that differ from what the edit form was
+  # rendered with, as one UPDATE guarded by the version it was rendered at.
+  # `derive(submitted, changes)` may add columns computed from the changes.
+  # returns False when someone else saved the record in the meantime.
+  submitted, changes = changed_fields(form, fields)
+  if not changes:
+    return True
+  try:
+    version = int(form.version.data)
+  except (TypeError, ValueError):
+    # without the version it was rendered at, the edit can't be told apart
+    # from one made against a stale copy
+    return False
+  if derive is not None:
+    changes.update(derive(submitted, changes))
+  result = db.session.execute(
+    model.__table__.update()
+    .where(model.id == record_id)
+    .where(model.version == version)
+    .values(version=version + 1, **changes)
+  )
+  return result.rowcount == 1
+
+def uncount_moving_shows(form, fields, rollup_fields, column, record_id):
+  # an edit to what a record's shows are counted under (a venue's city, an
+  # artist's genres) takes its shows out of the rollups; they are counted
+  # again under the new values once the update is in
+  _, changes = changed_fields(form, fields)
+  if not set(rollup_fields) & set(changes):
+    return []
+  shows = shows_of(db.session, column, record_id)
+  record_shows(db.session, shows, sign=-1)
+  return shows
+
+def venue_location(submitted, changes):
+  # a venue moving to another city moves to that city's centroid
+  if 'city' not in changes and 'state' not in changes:
+    return {}
+  latitude, longitude = city_centroid(submitted['city'], submitted['state'])
+  return {'latitude': latitude, 'longitude': longitude}
+
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   # populate form with fields from artist with ID <artist_id>
   artist = Artist.query.get(artist_id)
   form = ArtistForm()
-  # form.genres.populate_obj(artist.genres.split(","))
-  form.genres.default = artist.genres.split(",")
-  form.name.default = artist.name
-  form.city.default = artist.city
-  form.state.default = artist.state
-  form.phone.default = artist.phone
-  form.facebook_link.default = artist.facebook_link
-  form.website_link.default = artist.website_link
-  form.image_link.default = artist.image_link
-  form.seeking_venue.default = artist.seeking_venue
-  form.seeking_description.default = artist.seeking_description
-  form.process()
+  populate_edit_form(form, artist, ARTIST_FIELDS)
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
@@ -356,45 +561,31 @@ def edit_artist_submission(artist_id):
   # take values from the form submitted, and update existing
   # artist record with ID <artist_id> using the new attributes
   try:
-    artist = Artist.query.get(artist_id)
     form = ArtistForm(request.form)
-
-    artist.name = form.name.data
-    artist.city = form.city.data
-    artist.state = form.state.data
-    artist.phone = form.phone.data
-    artist.facebook_link = form.facebook_link.data
-    artist.website_link = form.website_link.data
-    artist.image_link = form.image_link.data
-    artist.seeking_venue = form.seeking_venue.data
-    artist.seeking_description = form.seeking_description.data
-    artist.genres = ",".join(form.genres.data)
-
+    moving = uncount_moving_shows(form, ARTIST_FIELDS, ARTIST_ROLLUP_FIELDS, 'artist_id', artist_id)
+    if not update_changed_fields(Artist, artist_id, form, ARTIST_FIELDS):
+      db.session.rollback()
+      flash('ARTIST ' + request.form['name'] + ' WAS CHANGED BY SOMEONE ELSE WHILE YOU WERE EDITING. '
+            'REVIEW THE LATEST VERSION AND SAVE AGAIN.')
+      return redirect(url_for('edit_artist', artist_id=artist_id))
+    record_shows(db.session, moving)
     db.session.commit()
+    matchmaker.put_artist(artist_id, ",".join(form.genres.data), form.city.data, form.state.data, form.seeking_venue.data)
     flash('ARTIST ' + request.form['name'] + ' WAS SUCCESSFULLY UPDATED!')
   except:
     db.session.rollback()
     flash('FAILED TO UPDATE' + request.form['name'] + ' DATA !!')
-  
-  return redirect(url_for('show_artist', artist_id=artist.id))
+  finally:
+    db.session.close()
+
+  return redirect(url_for('show_artist', artist_id=artist_id))
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
-  venue = Venue.query.get(venue_id)
-  form = VenueForm(obj=venue)
   # populate form with values from venue with ID <venue_id>
-  form.genres.default = venue.genres.split(",")
-  form.name.default = venue.name
-  form.city.default = venue.city
-  form.state.default = venue.state
-  form.address.default = venue.address
-  form.phone.default = venue.phone
-  form.facebook_link.default = venue.facebook_link
-  form.website_link.default = venue.website_link
-  form.image_link.default = venue.image_link
-  form.seeking_talent.default = venue.seeking_talent
-  form.seeking_description.default = venue.seeking_description
-  form.process()
+  venue = Venue.query.get(venue_id)
+  form = VenueForm()
+  populate_edit_form(form, venue, VENUE_FIELDS)
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
@@ -402,28 +593,25 @@ def edit_venue_submission(venue_id):
   # take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
   try:
-    venue = Venue.query.get(venue_id)
     form = VenueForm(request.form)
-
-    venue.name = form.name.data
-    venue.city = form.city.data
-    venue.state = form.state.data
-    venue.phone = form.phone.data
-    venue.address = form.address.data
-    venue.facebook_link = form.facebook_link.data
-    venue.website_link = form.website_link.data
-    venue.image_link = form.image_link.data
-    venue.seeking_talent = form.seeking_talent.data
-    venue.seeking_description = form.seeking_description.data
-    venue.genres = ",".join(form.genres.data)
-
+    moving = uncount_moving_shows(form, VENUE_FIELDS, VENUE_ROLLUP_FIELDS, 'venue_id', venue_id)
+    if not update_changed_fields(Venue, venue_id, form, VENUE_FIELDS, derive=venue_location):
+      db.session.rollback()
+      flash('VENUE ' + request.form['name'] + ' WAS CHANGED BY SOMEONE ELSE WHILE YOU WERE EDITING. '
+            'REVIEW THE LATEST VERSION AND SAVE AGAIN.')
+      return redirect(url_for('edit_venue', venue_id=venue_id))
+    record_shows(db.session, moving)
     db.session.commit()
+    venue_index.add(venue_id, *city_centroid(form.city.data, form.state.data))
+    matchmaker.put_venue(venue_id, ",".join(form.genres.data), form.city.data, form.state.data, form.seeking_talent.data)
     flash('VENUE ' + request.form['name'] + ' WAS SUCCESSFULLY UPDATED!')
   except:
     db.session.rollback()
     flash('FAILED TO UPDATE' + request.form['name'] + ' DATA !!')
+  finally:
+    db.session.close()
 
-  return redirect(url_for('show_venue', venue_id=venue.id))
+  return redirect(url_for('show_venue', venue_id=venue_id))
 
 #  Create Artist
 #  ----------------------------------------------------------------
@@ -480,6 +668,7 @@ def create_artist_submission():
     )
     db.session.add(artist)
     db.session.commit()
+    matchmaker.put_artist(artist.id, genres, city, state, seeking_venue)
     flash('Artist ' + request.form['name'] + ' was successfully listed!')
   except:
     db.session.rollback()
@@ -508,7 +697,10 @@ def shows():
       "artist_image_link": show.artist.image_link,
       "start_time": str(show.start_time)
     })
-  return render_template('pages/shows.html', shows=data)
+  # shows before the cutoff have moved to shows_archive and are only listed
+  # on their artist's and venue's pages
+  archived_before = archive_cutoff(app.config['SHOW_ARCHIVE_AFTER_DAYS'])
+  return render_template('pages/shows.html', shows=data, archived_before=archived_before)
 
 @app.route('/shows/create')
 def create_shows():
@@ -539,7 +731,9 @@ def create_show_submission():
       venue_id=venue_id
     )
     db.session.add(show)
+    record_shows(db.session, [(start_time, artist_id, venue_id)])
     db.session.commit()
+    matchmaker.add_show(artist_id, venue_id, start_time)
     flash('Show was successfully listed!')
   except:
     db.session.rollback()
@@ -549,6 +743,189 @@ def create_show_submission():
   
   return render_template('pages/home.html')
 
+# the most shows one tour submission may list; each is flashed back on failure
+TOUR_MAX_SHOWS = 500
+
+@app.route('/shows/create/tour')
+def create_tour():
+  form = TourForm()
+  return render_template('forms/new_tour.html', form=form, max_shows=TOUR_MAX_SHOWS)
+
+@app.route('/shows/create/tour', methods=['POST'])
+def create_tour_submission():
+  # creates every date of an artist's tour in one transaction.
+  # rows that can't be parsed or point at unknown venues are reported
+  # back individually and skipped, the rest of the batch is still listed.
+  form = TourForm(request.form)
+  lines = [
+    (line_number, line) for line_number, line in enumerate((form.shows.data or '').splitlines(), start=1)
+    if line.strip()
+  ]
+  if len(lines) > TOUR_MAX_SHOWS:
+    flash('A tour can list at most %d shows at once, this one has %d.' % (TOUR_MAX_SHOWS, len(lines)))
+    return render_template('forms/new_tour.html', form=form, max_shows=TOUR_MAX_SHOWS)
+  rows = []
+  failures = []
+  for line_number, line in lines:
+    try:
+      venue_id, start_time = line.split(',', 1)
+      rows.append({
+        'line': line_number,
+        'venue_id': int(venue_id),
+        # exactly the advertised format: no offsets, no guessing day from month
+        'start_time': datetime.strptime(start_time.strip(), '%Y-%m-%d %H:%M')
+      })
+    except ValueError:
+      failures.append('Line %d: expected "venue_id, YYYY-MM-DD HH:MM".' % line_number)
+
+  listed = []
+  try:
+    artist_id = int(form.artist_id.data)
+    if Artist.query.get(artist_id) is None:
+      raise Exception("Unknown artist!!")
+
+    # a single IN query validates every referenced venue
+    venue_ids = {row['venue_id'] for row in rows}
+    known_venues = {
+      venue_id for (venue_id,) in
+      db.session.query(Venue.id).filter(Venue.id.in_(venue_ids))
+    } if venue_ids else set()
+
+    shows = []
+    for row in rows:
+      if row['venue_id'] not in known_venues:
+        failures.append('Line %d: venue %d does not exist.' % (row['line'], row['venue_id']))
+        continue
+      shows.append({
+        'artist_id': artist_id,
+        'venue_id': row['venue_id'],
+        'start_time': row['start_time']
+      })
+
+    if shows:
+      # executemany: one INSERT statement for the whole tour
+      db.session.execute(Show.__table__.insert(), shows)
+      record_shows(db.session, [(show['start_time'], artist_id, show['venue_id']) for show in shows])
+      db.session.commit()
+      listed = shows
+    flash('%d of %d shows were successfully listed!' % (len(shows), len(shows) + len(failures)))
+    for failure in failures:
+      flash(failure)
+  except:
+    db.session.rollback()
+    flash('An error occurred. Tour could not be listed.')
+  finally:
+    db.session.close()
+
+  # after the try, so nothing here can report a committed tour as not listed
+  for show in listed:
+    matchmaker.add_show(show['artist_id'], show['venue_id'], show['start_time'])
+
+  return render_template('pages/home.html')
+
+#  Analytics
+#  ----------------------------------------------------------------
+
+def analytics_window():
+  # ?months=N (up to ten years) ending ?until=YYYY-MM (this month by default),
+  # with the ?top=N busiest cities
+  months = min(max(request.args.get('months', app.config['ANALYTICS_MONTHS'], type=int), 1), 120)
+  top = min(max(request.args.get('top', app.config['ANALYTICS_TOP_CITIES'], type=int), 1), 50)
+  until = request.args.get('until')
+  try:
+    last = datetime.strptime(until, '%Y-%m') if until else datetime.now()
+  except ValueError:
+    abort(400)
+  # the window and the year before it reach back up to eleven years, which
+  # early years have no dates for; there are no shows that old anyway
+  if last.year < 1900:
+    abort(400)
+  return dashboard(db.session, last, months, top)
+
+@app.route('/analytics')
+def analytics():
+  # show volume dashboards, read from the show_rollups table only
+  return render_template('pages/analytics.html', data=analytics_window())
+
+@app.route('/analytics.json')
+def analytics_json():
+  return jsonify(analytics_window())
+
+#  Thumbnails
+#  ----------------------------------------------------------------
+
+@app.route('/thumbnails/<size>')
+@limit_class('thumbnail')
+def thumbnail(size):
+  # serves a resized, locally cached copy of an artist or venue image_link.
+  # pages embed dozens of these, so their class has a deep bucket but few
+  # may wait on a fetch at once.
+  url = request.args.get('url', '')
+  if size not in thumbnail_cache.sizes or not url.startswith(('http://', 'https://')):
+    abort(404)
+  if not thumbnail_cache.cached(url, size):
+    # only images listed on the site are proxied, not arbitrary URLs;
+    # both image_link columns are indexed for this lookup
+    listed = (
+      db.session.query(Venue.id).filter(Venue.image_link == url).first() or
+      db.session.query(Artist.id).filter(Artist.image_link == url).first()
+    )
+    if not listed:
+      abort(404)
+  try:
+    path = thumbnail_cache.get(url, size)
+  except FetchError as e:
+    app.logger.warning(str(e))
+    return redirect(url)
+  response = send_file(path, mimetype='image/jpeg')
+  response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % app.config['THUMBNAIL_MAX_AGE']
+  return response
+
+#  Admin
+#  ----------------------------------------------------------------
+
+# admitted / rate_limited / shed / in_flight counts per route class,
+# alongside the limits currently in force; only with the ADMIN_TOKEN
+app.add_url_rule('/admin/limits', 'admission_stats', admission.stats_view)
+
+@app.route('/metrics')
+@limit_class('metrics')
+def metrics():
+  # Prometheus scrape endpoint: per-endpoint latency, status codes, in-flight requests
+  return Response(request_metrics.exposition(), mimetype='text/plain; version=0.0.4')
+
+#  Commands
+#  ----------------------------------------------------------------
+
+@app.cli.command('geocode-venues')
+def geocode_venues():
+  # fills in latitude/longitude for venues listed before they were tracked
+  # (or whose city has since been added to data/city_centroids.csv)
+  located = 0
+  venues = Venue.query.filter(Venue.latitude.is_(None)).all()
+  for venue in venues:
+    venue.latitude, venue.longitude = city_centroid(venue.city, venue.state)
+    if venue.latitude is not None:
+      located += 1
+  db.session.commit()
+  print('Located %d of %d venues.' % (located, len(venues)))
+
+@app.cli.command('maintain-shows')
+def maintain_shows_command():
+  # run daily: on PostgreSQL, creates the coming months' partitions of shows;
+  # everywhere, moves shows older than SHOW_ARCHIVE_AFTER_DAYS to shows_archive
+  print(maintain_shows(
+    db.engine,
+    app.config['SHOW_ARCHIVE_AFTER_DAYS'],
+    app.config['SHOW_PARTITION_MONTHS_AHEAD']
+  ))
+
+@app.cli.command('backfill-rollups')
+def backfill_rollups_command():
+  # rebuilds show_rollups from scratch: once when it is introduced, and
+  # whenever shows were written around the app (e.g. by hand in psql)
+  print('Counted %d shows.' % backfill_rollups(db.engine))
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -558,15 +935,8 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+# JSON lines in ACCESS_LOG / ERROR_LOG, written by a background listener thread
+setup_logging(app)
 
 #----------------------------------------------------------------------------#
 # Launch.
@@ -1,6 +1,6 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, TextAreaField, HiddenField
 from wtforms.validators import DataRequired, AnyOf, URL
 
 class ShowForm(Form):
@@ -16,6 +16,15 @@ class ShowForm(Form):
         default= datetime.today()
     )
 
+class TourForm(Form):
+    artist_id = StringField(
+        'artist_id', validators=[DataRequired()]
+    )
+    # one show per line: "venue_id, YYYY-MM-DD HH:MM"
+    shows = TextAreaField(
+        'shows', validators=[DataRequired()]
+    )
+
 class VenueForm(Form):
     name = StringField(
         'name', validators=[DataRequired()]
@@ -126,6 +135,14 @@ class VenueForm(Form):
         'seeking_description'
     )
 
+    # version and column snapshot the edit form was rendered from
+    version = HiddenField(
+        'version'
+    )
+    original = HiddenField(
+        'original'
+    )
+
 
 
 class ArtistForm(Form):
@@ -237,3 +254,11 @@ class ArtistForm(Form):
             'seeking_description'
      )
 
+    # version and column snapshot the edit form was rendered from
+    version = HiddenField(
+            'version'
+     )
+    original = HiddenField(
+            'original'
+     )
+
@@ -0,0 +1,226 @@
+import csv
+import heapq
+import math
+import os
+import threading
+import time
+
+
+# Venues are located at the centroid of their city, looked up in a table
+# bundled with the app (no geocoding service), and searched through an
+# in-memory grid so radius and nearest-k queries never touch the database.
+
+EARTH_RADIUS_KM = 6371.0
+CENTROIDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'city_centroids.csv')
+
+
+def _load_centroids(path=CENTROIDS_PATH):
+    with open(path, newline='') as f:
+        return {
+            (row['city'].lower(), row['state'].upper()): (float(row['latitude']), float(row['longitude']))
+            for row in csv.DictReader(f)
+        }
+
+CITY_CENTROIDS = _load_centroids()
+
+
+def city_centroid(city, state):
+    """Returns (latitude, longitude) of a bundled city, or (None, None) when it isn't in the table."""
+    return CITY_CENTROIDS.get(((city or '').strip().lower(), (state or '').strip().upper()), (None, None))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """Buckets points into fixed-size lat/lon cells.
+
+    A query only measures distances to points in the handful of cells that
+    can intersect the search circle, so cost depends on local density rather
+    than on the total number of venues. Columns wrap around at the
+    antimeridian, and a circle reaching a pole covers every column.
+    """
+
+    def __init__(self, cell_degrees=0.5):
+        self.cell_degrees = cell_degrees
+        self.columns = int(round(360 / cell_degrees))
+        self.rows = (int(math.floor(-90 / cell_degrees)), int(math.floor(90 / cell_degrees)))
+        self.cells = {}
+        self.points = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell(self, lat, lon):
+        return (int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees)) % self.columns)
+
+    def add(self, key, lat, lon):
+        with self._lock:
+            self._put(key, lat, lon)
+
+    def remove(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _put(self, key, lat, lon):
+        self._discard(key)
+        if lat is None or lon is None:
+            return
+        self.points[key] = (lat, lon)
+        self.cells.setdefault(self._cell(lat, lon), {})[key] = (lat, lon)
+
+    def _discard(self, key):
+        point = self.points.pop(key, None)
+        if point is not None:
+            cell = self._cell(*point)
+            self.cells[cell].pop(key, None)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def _wrap_columns(self, first, last):
+        if last - first + 1 >= self.columns:
+            return range(self.columns)
+        return sorted({col % self.columns for col in range(first, last + 1)})
+
+    def _ring(self, lat, lon, radius):
+        # cells within `radius` cells of the query cell, excluding closer
+        # rings; once a ring wraps all the way round it can repeat cells
+        row, col = self._cell(lat, lon)
+        if radius == 0:
+            yield row, col
+            return
+        for r in range(max(row - radius, self.rows[0]), min(row + radius, self.rows[1]) + 1):
+            if abs(r - row) == radius:
+                for c in self._wrap_columns(col - radius, col + radius):
+                    yield r, c
+            else:
+                yield r, (col - radius) % self.columns
+                yield r, (col + radius) % self.columns
+
+    def within(self, lat, lon, km):
+        """Returns [(distance_km, key)] for every point within `km`, nearest first."""
+        angle = km / EARTH_RADIUS_KM
+        lat_span = math.degrees(angle)
+        if abs(lat) + lat_span >= 90 or angle >= math.pi / 2:
+            # the circle reaches a pole: every longitude is in it
+            columns = range(self.columns)
+        else:
+            # widest longitude on a circle of `angle` around the point, a hair
+            # wider so points on the boundary aren't lost to rounding
+            lon_span = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(lat))))) + 1e-9
+            first = int(math.floor((lon - lon_span) / self.cell_degrees))
+            last = int(math.floor((lon + lon_span) / self.cell_degrees))
+            columns = self._wrap_columns(first, last)
+        row_min = max(self._cell(max(lat - lat_span, -90.0), lon)[0], self.rows[0])
+        row_max = min(self._cell(min(lat + lat_span, 90.0), lon)[0], self.rows[1])
+        found = []
+        with self._lock:
+            for row in range(row_min, row_max + 1):
+                for col in columns:
+                    for key, (plat, plon) in self.cells.get((row, col), {}).items():
+                        distance = haversine_km(lat, lon, plat, plon)
+                        if distance <= km:
+                            found.append((distance, key))
+        found.sort()
+        return found
+
+    def nearest(self, lat, lon, k):
+        """Returns [(distance_km, key)] for the `k` nearest points, nearest first."""
+        if k <= 0:
+            return []
+        best = []  # max-heap of (-distance, key)
+        visited = set()
+        max_rings = max(self.rows[1] - self.rows[0], self.columns) + 1
+        with self._lock:
+            for radius in range(max_rings):
+                # every point not yet visited is at least radius - 1 cells away,
+                # either in rows or in columns. Rows that far apart are that
+                # many degrees of latitude apart; columns that far apart are
+                # at least the distance to the meridian that many degrees of
+                # longitude away. Once a ring spans every column, only the
+                # rows are left.
+                gap = math.radians(max(radius - 1, 0) * self.cell_degrees)
+                bound = EARTH_RADIUS_KM * gap
+                if 2 * radius + 1 < self.columns:
+                    to_meridian = math.asin(min(1.0, math.cos(math.radians(lat)) * math.sin(min(gap, math.pi / 2))))
+                    bound = min(bound, EARTH_RADIUS_KM * to_meridian)
+                if len(best) == k and -best[0][0] <= bound:
+                    break
+                if len(best) == len(self.points):
+                    break
+                for cell in self._ring(lat, lon, radius):
+                    if cell in visited:
+                        continue
+                    visited.add(cell)
+                    for key, (plat, plon) in self.cells.get(cell, {}).items():
+                        distance = haversine_km(lat, lon, plat, plon)
+                        if len(best) < k:
+                            heapq.heappush(best, (-distance, key))
+                        elif distance < -best[0][0]:
+                            heapq.heapreplace(best, (-distance, key))
+        return sorted((-distance, key) for distance, key in best)
+
+
+class VenueIndex(GridIndex):
+    """The grid of all venue locations, loaded from the database on first use.
+
+    Edits made by this process are applied incrementally; the whole index is
+    reloaded every `ttl` seconds to pick up writes made by other processes.
+    One request at a time reloads, while the others keep searching the index
+    as it was, and edits made meanwhile are applied again to the new one.
+    """
+
+    def __init__(self, cell_degrees=0.5, ttl=300):
+        super().__init__(cell_degrees)
+        self.ttl = ttl
+        self.loaded_at = None
+        self._reload_lock = threading.Lock()
+        self._changes = None
+
+    def fresh(self):
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    def add(self, key, lat, lon):
+        with self._lock:
+            self._apply(lambda: self._put(key, lat, lon))
+
+    def remove(self, key):
+        with self._lock:
+            self._apply(lambda: self._discard(key))
+
+    def _apply(self, change):
+        change()
+        if self._changes is not None:
+            self._changes.append(change)
+
+    def ensure_loaded(self, session, model):
+        if self.fresh():
+            return
+        # until the first load there is nothing to search, so only then wait
+        if not self._reload_lock.acquire(blocking=self.loaded_at is None):
+            return
+        try:
+            if self.fresh():
+                return
+            with self._lock:
+                self._changes = []
+            rows = session.query(model.id, model.latitude, model.longitude).filter(model.latitude.isnot(None))
+            cells, points = {}, {}
+            for key, lat, lon in rows:
+                points[key] = (lat, lon)
+                cells.setdefault(self._cell(lat, lon), {})[key] = (lat, lon)
+            with self._lock:
+                self.cells, self.points = cells, points
+                # the rows may have been read before these edits
+                for change in self._changes:
+                    change()
+                self.loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._changes = None
+            self._reload_lock.release()
@@ -0,0 +1,306 @@
+"""Closed-loop load generator for Fyyur.
+
+Each virtual user runs its own keep-alive connection, waits for a response,
+thinks for a while and then sends its next request, so throughput is what
+the server actually sustains rather than what we choose to offer.
+
+    python loadgen.py --start --profile browse --duration 60
+    python loadgen.py --url http://localhost:5000 --profile ticket-drop
+
+--start launches the app locally (a threaded `flask run`) and stops it at
+the end, with the settings in loadgen.cfg (or --settings) over config.py.
+Every virtual user comes from the same address, so those settings drop the
+per-client rate limits that would otherwise throttle the whole run as one
+client. Against --url the server's own limits apply; 429/503 responses are
+reported as "shed".
+"""
+import argparse
+import http.client
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+
+# weights of each kind of request in a profile's route mix
+PROFILES = {
+    # an ordinary evening of people browsing listings
+    'browse': {
+        'users': 20,
+        'think_time': 1.0,
+        'ramp_up': 10,
+        'mix': {
+            'home': 15,
+            'venues': 15,
+            'artists': 10,
+            'shows': 10,
+            'venue_detail': 20,
+            'artist_detail': 15,
+            'search_venues': 6,
+            'search_artists': 5,
+            'create_show': 4,
+        },
+    },
+    # a popular tour goes on sale: everyone piles onto the same few detail
+    # pages and searches at once, with almost no think time
+    'ticket-drop': {
+        'users': 200,
+        'think_time': 0.1,
+        'ramp_up': 5,
+        'hot_set': 3,
+        'mix': {
+            'home': 10,
+            'shows': 15,
+            'venue_detail': 25,
+            'artist_detail': 30,
+            'search_venues': 8,
+            'search_artists': 10,
+            'create_show': 2,
+        },
+    },
+    # a steady stream of bookings, to measure the write path
+    'bookings': {
+        'users': 10,
+        'think_time': 0.5,
+        'ramp_up': 2,
+        'mix': {
+            'venue_detail': 30,
+            'artist_detail': 30,
+            'create_show': 40,
+        },
+    },
+}
+
+# what --start runs the app with unless --settings says otherwise
+DEFAULT_SETTINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'loadgen.cfg')
+
+SEARCH_TERMS = ['a', 'the', 'music', 'hop', 'band', 'San Francisco, CA', 'New York, NY', 'jazz']
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class Catalog:
+    """The artist and venue ids to pick requests from, scraped from the listing pages."""
+
+    def __init__(self, base_url, hot_set=None):
+        with urllib.request.urlopen(base_url + '/venues') as response:
+            self.venue_ids = sorted(set(map(int, re.findall(r'href="/venues/(\d+)"', response.read().decode()))))
+        with urllib.request.urlopen(base_url + '/artists') as response:
+            self.artist_ids = sorted(set(map(int, re.findall(r'href="/artists/(\d+)"', response.read().decode()))))
+        if not self.venue_ids or not self.artist_ids:
+            raise SystemExit('The server needs at least one venue and one artist to generate load against.')
+        if hot_set:
+            self.venue_ids = self.venue_ids[:hot_set]
+            self.artist_ids = self.artist_ids[:hot_set]
+
+    def request(self, kind, rng):
+        """Returns (method, path, form) for one request of the given kind."""
+        if kind == 'home':
+            return 'GET', '/', None
+        if kind in ('venues', 'artists', 'shows'):
+            return 'GET', '/' + kind, None
+        if kind == 'venue_detail':
+            return 'GET', '/venues/%d' % rng.choice(self.venue_ids), None
+        if kind == 'artist_detail':
+            return 'GET', '/artists/%d' % rng.choice(self.artist_ids), None
+        if kind == 'search_venues':
+            return 'POST', '/venues/search', {'search_term': rng.choice(SEARCH_TERMS)}
+        if kind == 'search_artists':
+            return 'POST', '/artists/search', {'search_term': rng.choice(SEARCH_TERMS)}
+        if kind == 'create_show':
+            start_time = datetime.now() + timedelta(days=rng.randint(1, 365), hours=rng.randint(0, 23))
+            return 'POST', '/shows/create', {
+                'artist_id': rng.choice(self.artist_ids),
+                'venue_id': rng.choice(self.venue_ids),
+                'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'),
+            }
+        raise ValueError('Unknown request kind: %s' % kind)
+
+
+class Results:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.interval = []
+        self.by_kind = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+
+    def record(self, kind, elapsed, outcome):
+        with self.lock:
+            self.interval.append((elapsed, outcome))
+            self.by_kind[kind].append(elapsed)
+            self.outcomes[kind][outcome] += 1
+
+    def take_interval(self):
+        with self.lock:
+            interval, self.interval = self.interval, []
+        return interval
+
+
+def outcome_of(status):
+    if status in (429, 503):
+        return 'shed'
+    if status >= 400:
+        return 'error'
+    return 'ok'
+
+
+def virtual_user(number, base_url, catalog, profile, results, stop, start_at):
+    rng = random.Random(number)
+    kinds, weights = zip(*profile['mix'].items())
+    url = urllib.parse.urlsplit(base_url)
+    connection = None
+    while time.monotonic() < start_at:
+        if stop.wait(0.05):
+            return
+    while not stop.is_set():
+        kind = rng.choices(kinds, weights)[0]
+        method, path, form = catalog.request(kind, rng)
+        body = urllib.parse.urlencode(form) if form else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if form else {}
+        started = time.perf_counter()
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            outcome = outcome_of(response.status)
+        except (OSError, http.client.HTTPException):
+            outcome = 'error'
+            if connection is not None:
+                connection.close()
+            connection = None
+        results.record(kind, time.perf_counter() - started, outcome)
+        stop.wait(rng.expovariate(1 / profile['think_time']) if profile['think_time'] else 0)
+    if connection is not None:
+        connection.close()
+
+
+def report_interval(elapsed, interval, seconds):
+    latencies = sorted(latency for latency, _ in interval)
+    counts = defaultdict(int)
+    for _, outcome in interval:
+        counts[outcome] += 1
+    total = len(interval)
+    print('%6.0fs  %8.1f req/s  p50 %7.1f ms  p95 %7.1f ms  p99 %7.1f ms  errors %5.1f%%  shed %5.1f%%' % (
+        elapsed, total / seconds,
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000, percentile(latencies, 0.99) * 1000,
+        100.0 * counts['error'] / total if total else 0.0,
+        100.0 * counts['shed'] / total if total else 0.0,
+    ))
+
+
+def report_summary(results, duration):
+    print()
+    print('%-16s %8s %9s %9s %9s %9s %7s %7s' % ('route', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors', 'shed'))
+    for kind in sorted(results.by_kind):
+        latencies = sorted(results.by_kind[kind])
+        outcomes = results.outcomes[kind]
+        print('%-16s %8d %9.1f %9.1f %9.1f %9.1f %7d %7d' % (
+            kind, len(latencies), len(latencies) / duration,
+            percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000, percentile(latencies, 0.99) * 1000,
+            outcomes['error'], outcomes['shed'],
+        ))
+    everything = sorted(latency for latencies in results.by_kind.values() for latency in latencies)
+    ok = sum(outcomes['ok'] for outcomes in results.outcomes.values())
+    print('total: %d requests, %.1f req/s, %.1f successful req/s, p99 %.1f ms' % (
+        len(everything), len(everything) / duration, ok / duration, percentile(everything, 0.99) * 1000))
+
+
+def start_server(port, settings):
+    env = dict(os.environ, FLASK_APP='app', FYYUR_SETTINGS=os.path.abspath(settings))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'flask', 'run', '--port', str(port), '--with-threads', '--no-reload'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env
+    )
+    base_url = 'http://127.0.0.1:%d' % port
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit('The server exited during startup.')
+        try:
+            urllib.request.urlopen(base_url + '/', timeout=1).read()
+            return server, base_url
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit('The server did not come up within 30 seconds.')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Closed-loop load generator for Fyyur.')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='server to load (ignored with --start)')
+    parser.add_argument('--start', action='store_true', help='start the app locally for the run')
+    parser.add_argument('--port', type=int, default=5055, help='port for --start')
+    parser.add_argument('--settings',
+                        help='config file for --start, loaded over config.py (default: loadgen.cfg)')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='browse')
+    parser.add_argument('--users', type=int, help='virtual users (overrides the profile)')
+    parser.add_argument('--think-time', type=float, help='mean seconds between requests per user (overrides the profile)')
+    parser.add_argument('--ramp-up', type=float, help='seconds over which users are started (overrides the profile)')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run after ramp-up begins')
+    parser.add_argument('--interval', type=float, default=5, help='seconds between progress lines')
+    args = parser.parse_args(argv)
+    if args.settings and not args.start:
+        parser.error('--settings only applies to a server started with --start')
+
+    profile = dict(PROFILES[args.profile])
+    for option in ('users', 'think_time', 'ramp_up'):
+        if getattr(args, option) is not None:
+            profile[option] = getattr(args, option)
+
+    server = None
+    base_url = args.url.rstrip('/')
+    if args.start:
+        server, base_url = start_server(args.port, args.settings or DEFAULT_SETTINGS)
+    try:
+        catalog = Catalog(base_url, profile.get('hot_set'))
+        results = Results()
+        stop = threading.Event()
+        began = time.monotonic()
+        users = [
+            threading.Thread(
+                target=virtual_user,
+                args=(number, base_url, catalog, profile, results, stop,
+                      began + profile['ramp_up'] * number / profile['users']),
+                daemon=True
+            )
+            for number in range(profile['users'])
+        ]
+        print('%s: %d users, %.2fs think time, %ss ramp-up against %s' % (
+            args.profile, profile['users'], profile['think_time'], profile['ramp_up'], base_url))
+        for user in users:
+            user.start()
+        next_report = began + args.interval
+        try:
+            while time.monotonic() - began < args.duration:
+                time.sleep(max(0, min(next_report, began + args.duration) - time.monotonic()))
+                if time.monotonic() >= next_report:
+                    report_interval(time.monotonic() - began, results.take_interval(), args.interval)
+                    next_report += args.interval
+        except KeyboardInterrupt:
+            pass
+        stop.set()
+        for user in users:
+            user.join(timeout=35)
+        report_summary(results, time.monotonic() - began)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import heapq
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+
+# Ranks venues for an artist and artists for a venue from an in-memory
+# inverted index: each genre maps to a bitset (a Python int with bit `id`
+# set) of the entities playing it, so candidates for a request are a few
+# ORs instead of a pairwise join over the whole catalog.
+
+GENRE_WEIGHT = 0.6
+SAME_CITY_WEIGHT = 0.25
+SAME_STATE_WEIGHT = 0.1
+ACTIVITY_WEIGHT = 0.15
+ACTIVITY_CAP = 10
+# activity is the shows played in the last RECENT_DAYS or booked for the
+# next UPCOMING_DAYS
+RECENT_DAYS = 90
+UPCOMING_DAYS = 90
+
+
+def split_genres(genres):
+    return frozenset(genre.strip() for genre in (genres or '').split(',') if genre.strip())
+
+
+def activity_window(now=None):
+    now = now or datetime.now()
+    return now - timedelta(days=RECENT_DAYS), now + timedelta(days=UPCOMING_DAYS)
+
+
+def iter_bits(bitset):
+    """Yields the position of every set bit, lowest first."""
+    bits = bin(bitset)[:1:-1]
+    position = bits.find('1')
+    while position != -1:
+        yield position
+        position = bits.find('1', position + 1)
+
+
+class Catalog:
+    """The artists or the venues, indexed by genre."""
+
+    def __init__(self):
+        self.entities = {}
+        self.by_genre = {}
+        self.by_city = {}
+        self.by_state = {}
+        self.seeking = 0
+
+    def put(self, key, genres, city, state, seeking):
+        self.remove(key)
+        genres = split_genres(genres)
+        city, state = (city or '').strip().lower(), (state or '').strip().upper()
+        self.entities[key] = (genres, city, state)
+        bit = 1 << key
+        for genre in genres:
+            self.by_genre[genre] = self.by_genre.get(genre, 0) | bit
+        self.by_city[city, state] = self.by_city.get((city, state), 0) | bit
+        self.by_state[state] = self.by_state.get(state, 0) | bit
+        if seeking:
+            self.seeking |= bit
+
+    def remove(self, key):
+        entity = self.entities.pop(key, None)
+        if entity is None:
+            return
+        genres, city, state = entity
+        mask = ~(1 << key)
+        for genre in genres:
+            self.by_genre[genre] &= mask
+        self.by_city[city, state] &= mask
+        self.by_state[state] &= mask
+        self.seeking &= mask
+
+    def overlaps(self, genres):
+        """Returns {n: bitset} of the seeking entities sharing exactly n of `genres`."""
+        # bit-sliced counter: counters[i] holds bit i of every entity's count
+        counters = []
+        for genre in genres:
+            carry = self.by_genre.get(genre, 0) & self.seeking
+            for i, counter in enumerate(counters):
+                counters[i], carry = counter ^ carry, counter & carry
+            if carry:
+                counters.append(carry)
+        matched = 0
+        for counter in counters:
+            matched |= counter
+        overlaps = {}
+        for n in range(1, len(genres) + 1):
+            members = matched
+            for i, counter in enumerate(counters):
+                members &= counter if n >> i & 1 else ~counter
+            if n >> len(counters):
+                members = 0
+            if members:
+                overlaps[n] = members
+        return overlaps
+
+
+class Matchmaker:
+    """Artist and venue catalogs plus recent show counts, loaded on first use.
+
+    Edits made by this process are applied incrementally; everything is
+    reloaded every `ttl` seconds to pick up writes made by other processes.
+    One request at a time reloads, while the others keep ranking from the
+    catalogs as they were, and edits made meanwhile are applied again to the
+    new ones.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.loaded_at = None
+        self.artists = Catalog()
+        self.venues = Catalog()
+        self.artist_activity = Counter()
+        self.venue_activity = Counter()
+        self._lock = threading.RLock()
+        self._reload_lock = threading.Lock()
+        self._changes = None
+
+    def fresh(self):
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    def _apply(self, change):
+        change()
+        if self._changes is not None:
+            self._changes.append(change)
+
+    def ensure_loaded(self, session, Artist, Venue, Show):
+        if self.fresh():
+            return
+        # until the first load there is nothing to rank, so only then wait
+        if not self._reload_lock.acquire(blocking=self.loaded_at is None):
+            return
+        try:
+            if self.fresh():
+                return
+            with self._lock:
+                self._changes = []
+            self._reload(session, Artist, Venue, Show)
+        finally:
+            with self._lock:
+                self._changes = None
+            self._reload_lock.release()
+
+    def _reload(self, session, Artist, Venue, Show):
+        artists, venues = Catalog(), Catalog()
+        for row in session.query(Artist.id, Artist.genres, Artist.city, Artist.state, Artist.seeking_venue):
+            artists.put(*row)
+        for row in session.query(Venue.id, Venue.genres, Venue.city, Venue.state, Venue.seeking_talent):
+            venues.put(*row)
+        since, until = activity_window()
+        artist_activity, venue_activity = Counter(), Counter()
+        shows = session.query(Show.artist_id, Show.venue_id).filter(Show.start_time >= since, Show.start_time < until)
+        for artist_id, venue_id in shows:
+            artist_activity[artist_id] += 1
+            venue_activity[venue_id] += 1
+        with self._lock:
+            self.artists, self.venues = artists, venues
+            self.artist_activity, self.venue_activity = artist_activity, venue_activity
+            # the rows may have been read before these edits. Catalog edits
+            # are idempotent; a show the reload already counted is counted
+            # twice until the next one.
+            for change in self._changes:
+                change()
+            self.loaded_at = time.monotonic()
+
+    def put_artist(self, key, genres, city, state, seeking_venue):
+        with self._lock:
+            self._apply(lambda: self.artists.put(key, genres, city, state, seeking_venue))
+
+    def put_venue(self, key, genres, city, state, seeking_talent):
+        with self._lock:
+            self._apply(lambda: self.venues.put(key, genres, city, state, seeking_talent))
+
+    def remove_venue(self, key):
+        def remove():
+            self.venues.remove(key)
+            self.venue_activity.pop(key, None)
+        with self._lock:
+            self._apply(remove)
+
+    def add_show(self, artist_id, venue_id, start_time):
+        """Counts a newly listed show, if it falls in the same window a reload counts."""
+        since, until = activity_window()
+        if not since <= start_time < until:
+            return
+        def count():
+            self.artist_activity[artist_id] += 1
+            self.venue_activity[venue_id] += 1
+        with self._lock:
+            self._apply(count)
+
+    def venues_for_artist(self, artist_id, limit=20):
+        """Returns [(score, venue_id)] of the best venues for an artist, best first."""
+        with self._lock:
+            return self._rank(self.artists.entities.get(artist_id), self.venues, self.venue_activity, limit)
+
+    def artists_for_venue(self, venue_id, limit=20):
+        """Returns [(score, artist_id)] of the best artists for a venue, best first."""
+        with self._lock:
+            return self._rank(self.venues.entities.get(venue_id), self.artists, self.artist_activity, limit)
+
+    def _rank(self, source, targets, activity, limit):
+        if source is None or not source[0] or limit <= 0:
+            return []
+        genres, city, state = source
+        same_city = targets.by_city.get((city, state), 0)
+        same_state = targets.by_state.get(state, 0) & ~same_city
+        # every candidate in a class shares the same genre and location score,
+        # so whole classes are skipped once they can't beat the current top
+        classes = []
+        for n, members in targets.overlaps(genres).items():
+            base = GENRE_WEIGHT * n / len(genres)
+            classes.append((base + SAME_CITY_WEIGHT, members & same_city))
+            classes.append((base + SAME_STATE_WEIGHT, members & same_state))
+            classes.append((base, members & ~same_city & ~same_state))
+        classes.sort(key=lambda c: c[0], reverse=True)
+
+        top = []  # min-heap of the best `limit` (score, key)
+        for base, members in classes:
+            # scores are rounded before they're compared, and a class whose
+            # best could tie the current worst might still win on its key
+            if len(top) == limit and top[0][0] > round(base + ACTIVITY_WEIGHT, 3):
+                break
+            for key in iter_bits(members):
+                score = round(base + ACTIVITY_WEIGHT * min(activity.get(key, 0), ACTIVITY_CAP) / ACTIVITY_CAP, 3)
+                if len(top) < limit:
+                    heapq.heappush(top, (score, key))
+                elif (score, key) > top[0]:
+                    heapq.heapreplace(top, (score, key))
+        return sorted(top, reverse=True)
@@ -0,0 +1,197 @@
+import atexit
+import bisect
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, request
+from flask.logging import default_handler
+
+
+# Request threads only ever put log records on an in-memory queue; a single
+# listener thread formats them as JSON lines and does the file I/O. Request
+# latency, status codes and in-flight requests are tracked per endpoint and
+# served in the Prometheus text format.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+QUANTILES = (0.5, 0.95, 0.99)
+# the client picks the method, so any other is counted as 'other' rather
+# than growing a series of its own
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'where': '%s:%d' % (record.pathname, record.lineno),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class StructuredQueueHandler(QueueHandler):
+
+    def prepare(self, record):
+        # render the message and traceback on the request thread, while they
+        # still refer to its state, but leave the JSON to the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def setup_logging(app):
+    """Sends app.logger to the error log and per-request lines to the access log, off-thread."""
+    log_queue = queue.SimpleQueue()
+
+    access_handler = logging.FileHandler(app.config['ACCESS_LOG'])
+    access_handler.setFormatter(JsonFormatter())
+    access_handler.addFilter(lambda record: record.name == 'fyyur.access')
+    error_handler = logging.FileHandler(app.config['ERROR_LOG'])
+    error_handler.setFormatter(JsonFormatter())
+    error_handler.addFilter(lambda record: record.name != 'fyyur.access')
+
+    listener = QueueListener(log_queue, access_handler, error_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    queue_handler = StructuredQueueHandler(log_queue)
+    if not app.debug:
+        # Flask's own handler writes to stderr synchronously
+        app.logger.removeHandler(default_handler)
+    app.logger.setLevel(logging.INFO)
+    app.logger.addHandler(queue_handler)
+    access_logger = logging.getLogger('fyyur.access')
+    access_logger.setLevel(logging.INFO)
+    access_logger.propagate = False
+    access_logger.addHandler(queue_handler)
+    return listener
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimates the q-quantile by interpolating inside the bucket that holds it."""
+        if not self.count:
+            return float('nan')
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i]
+                if upper == float('inf'):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-2]
+
+
+class RequestMetrics:
+    """Per-endpoint latency histograms, status counts and in-flight gauges."""
+
+    def __init__(self, app=None):
+        self.latency = {}
+        self.statuses = Counter()
+        self.in_flight = Counter()
+        self._lock = threading.Lock()
+        self.access_log = logging.getLogger('fyyur.access')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['request_metrics'] = self
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._leave)
+
+    def _start(self):
+        g.request_started = time.perf_counter()
+        g.metrics_endpoint = request.endpoint or 'unmatched'
+        with self._lock:
+            self.in_flight[g.metrics_endpoint] += 1
+
+    def _finish(self, response):
+        elapsed = time.perf_counter() - g.request_started
+        key = (g.metrics_endpoint, request.method if request.method in METHODS else 'other')
+        with self._lock:
+            self.latency.setdefault(key, Histogram()).observe(elapsed)
+            self.statuses[key + (response.status_code,)] += 1
+        self.access_log.info('%s %s %s', request.method, request.path, response.status_code, extra={'fields': {
+            'method': request.method,
+            'path': request.path,
+            'endpoint': g.metrics_endpoint,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2),
+            'bytes': response.calculate_content_length(),
+            'remote_addr': request.remote_addr,
+        }})
+        return response
+
+    def _leave(self, exception=None):
+        endpoint = g.pop('metrics_endpoint', None)
+        if endpoint is not None:
+            with self._lock:
+                self.in_flight[endpoint] -= 1
+
+    def exposition(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines.append('# HELP fyyur_request_duration_seconds Request latency.')
+            lines.append('# TYPE fyyur_request_duration_seconds histogram')
+            for (endpoint, method), histogram in sorted(self.latency.items()):
+                labels = 'endpoint="%s",method="%s"' % (endpoint, method)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('fyyur_request_duration_seconds_bucket{%s,le="%s"} %d' % (labels, le, cumulative))
+                lines.append('fyyur_request_duration_seconds_sum{%s} %f' % (labels, histogram.sum))
+                lines.append('fyyur_request_duration_seconds_count{%s} %d' % (labels, histogram.count))
+
+            lines.append('# HELP fyyur_request_latency_seconds Request latency quantiles estimated from the histogram.')
+            lines.append('# TYPE fyyur_request_latency_seconds gauge')
+            for (endpoint, method), histogram in sorted(self.latency.items()):
+                for q in QUANTILES:
+                    lines.append('fyyur_request_latency_seconds{endpoint="%s",method="%s",quantile="%s"} %f'
+                                 % (endpoint, method, q, histogram.quantile(q)))
+
+            lines.append('# HELP fyyur_requests_total Requests served, by status code.')
+            lines.append('# TYPE fyyur_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.statuses.items()):
+                lines.append('fyyur_requests_total{endpoint="%s",method="%s",status="%d"} %d'
+                             % (endpoint, method, status, count))
+
+            lines.append('# HELP fyyur_requests_in_flight Requests currently being served.')
+            lines.append('# TYPE fyyur_requests_in_flight gauge')
+            for endpoint, count in sorted(self.in_flight.items()):
+                lines.append('fyyur_requests_in_flight{endpoint="%s"} %d' % (endpoint, count))
+        return '\n'.join(lines) + '\n'
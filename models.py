@@ -1,7 +1,7 @@
-from flask_sqlalchemy import SQLAlchemy
+from replicas import RoutingSQLAlchemy
 
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 
 class Venue(db.Model):
@@ -13,13 +13,19 @@ class Venue(db.Model):
     state = db.Column(db.String(120), nullable=False)
     address = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False, unique=True)
-    image_link = db.Column(db.String(500), nullable=False)
+    image_link = db.Column(db.String(500), nullable=False, index=True)
     facebook_link = db.Column(db.String(120), nullable=True)
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String, nullable=True)
     website_link = db.Column(db.String(), nullable=True)
     genres = db.Column(db.String(120))
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     shows = db.relationship("Show", backref="venue", lazy=True)
+    archived_shows = db.relationship("ArchivedShow", backref="venue", lazy=True)
+
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self) -> str:
        return f"<Venue: {self.name}>"
@@ -34,12 +40,16 @@ class Artist(db.Model):
     state = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False, unique=True)
     genres = db.Column(db.String(120))
-    image_link = db.Column(db.String(500), nullable=False)
+    image_link = db.Column(db.String(500), nullable=False, index=True)
     facebook_link = db.Column(db.String(120), nullable=True)
     website_link = db.Column(db.String(), nullable=True)
     seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String, nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     shows = db.relationship("Show", backref="artist", lazy=True)
+    archived_shows = db.relationship("ArchivedShow", backref="artist", lazy=True)
+
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self) -> str:
         return f"<Artist: {self.name}>"
@@ -47,6 +57,22 @@ class Artist(db.Model):
 
 class Show(db.Model):
     __tablename__ = 'shows'
+    # ids must never be reused once older shows have moved to shows_archive
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    start_time = db.Column(db.DateTime, nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey("artists.id"), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey("venues.id"), nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<Show: {self.artist_id} - {self.venue_id}>"
+
+
+class ArchivedShow(db.Model):
+    # shows that have long since happened, moved out of `shows` by
+    # `flask maintain-shows` so the hot table only holds recent and upcoming ones
+    __tablename__ = 'shows_archive'
 
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime, nullable=False)
@@ -54,4 +80,20 @@ class Show(db.Model):
     venue_id = db.Column(db.Integer, db.ForeignKey("venues.id"), nullable=False)
 
     def __repr__(self) -> str:
-        return f"<Show: {self.artist_id} - {self.venue_id}>"
\ No newline at end of file
+        return f"<ArchivedShow: {self.artist_id} - {self.venue_id}>"
+
+
+class ShowRollup(db.Model):
+    # number of shows per month, overall ('all'), per venue city ('city',
+    # "City, ST") and per artist genre ('genre'), kept up to date as shows
+    # are listed and deleted; see analytics.py
+    __tablename__ = 'show_rollups'
+
+    dimension = db.Column(db.String(10), primary_key=True)
+    label = db.Column(db.String(250), primary_key=True)
+    # dashboards read a window of months across every label
+    month = db.Column(db.Date, primary_key=True, index=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"<ShowRollup: {self.dimension} {self.label} {self.month}: {self.count}>"
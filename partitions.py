@@ -0,0 +1,207 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+
+# `shows` holds recent and upcoming shows, `shows_archive` the ones that
+# happened before the archive cutoff.
+#
+# On PostgreSQL both are natively partitioned by month on start_time
+# (shows_YYYY_MM). Archiving detaches whole months from `shows` and attaches
+# them to `shows_archive`, which is a catalog change rather than a row copy,
+# and queries on upcoming shows are pruned to the current and future months.
+# Other databases get two plain tables and archiving moves the rows.
+
+HOT_DEFAULT_PARTITION = 'shows_default'
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return '%s_%04d_%02d' % (table, month.year, month.month)
+
+
+def archive_cutoff(archive_after_days, now=None):
+    """Shows before this date are archived: the start of the month `archive_after_days` ago."""
+    return month_start((now or datetime.now()) - timedelta(days=archive_after_days))
+
+
+def is_partitioned(connection, table):
+    return connection.execute(
+        text("SELECT c.relkind = 'p' FROM pg_class c WHERE c.oid = to_regclass(:table)"),
+        {'table': table}
+    ).scalar() is True
+
+
+def months_between(first, last):
+    month = month_start(first)
+    while month <= last:
+        yield month
+        month = next_month(month)
+
+
+def _partition_table(connection, table, months, default_partition=None):
+    # swaps a plain table for a range-partitioned copy with the same rows
+    connection.execute(text('ALTER TABLE %s RENAME TO %s_unpartitioned' % (table, table)))
+    connection.execute(text(
+        'CREATE TABLE {0} (LIKE {0}_unpartitioned INCLUDING DEFAULTS) '
+        'PARTITION BY RANGE (start_time)'.format(table)
+    ))
+    # a partitioned table's unique keys must include the partition key
+    connection.execute(text('ALTER TABLE %s ADD PRIMARY KEY (id, start_time)' % table))
+    connection.execute(text('ALTER TABLE %s ADD FOREIGN KEY (artist_id) REFERENCES artists (id)' % table))
+    connection.execute(text('ALTER TABLE %s ADD FOREIGN KEY (venue_id) REFERENCES venues (id)' % table))
+    if default_partition:
+        connection.execute(text('CREATE TABLE %s PARTITION OF %s DEFAULT' % (default_partition, table)))
+    for month in months:
+        connection.execute(text(
+            "CREATE TABLE %s PARTITION OF %s FOR VALUES FROM ('%s') TO ('%s')"
+            % (partition_name(table, month), table, month, next_month(month))
+        ))
+    connection.execute(text('INSERT INTO {0} SELECT * FROM {0}_unpartitioned'.format(table)))
+    # keep the id sequence alive when the old table goes
+    sequence = connection.execute(
+        text("SELECT pg_get_serial_sequence(:table, 'id')"), {'table': table + '_unpartitioned'}
+    ).scalar()
+    if sequence:
+        connection.execute(text('ALTER SEQUENCE %s OWNED BY %s.id' % (sequence, table)))
+    connection.execute(text('DROP TABLE %s_unpartitioned' % table))
+
+
+def setup_postgres_partitions(connection):
+    """Converts `shows` and `shows_archive` to monthly range partitions, once."""
+    today = date.today()
+    if not is_partitioned(connection, 'shows'):
+        # months up to this one get partitions now, later rows wait in the
+        # default partition until create_postgres_partitions reaches them
+        earliest = connection.execute(text('SELECT min(start_time) FROM shows')).scalar()
+        months = months_between(min(earliest.date(), today) if earliest else today, today)
+        _partition_table(connection, 'shows', list(months), HOT_DEFAULT_PARTITION)
+    if not is_partitioned(connection, 'shows_archive'):
+        # archived months arrive as whole partitions detached from `shows`, so
+        # partitions are only needed for rows already archived row by row
+        earliest, latest = connection.execute(text('SELECT min(start_time), max(start_time) FROM shows_archive')).first()
+        months = months_between(earliest.date(), latest.date()) if earliest else []
+        _partition_table(connection, 'shows_archive', list(months))
+
+
+def create_postgres_partitions(connection, months_ahead):
+    """Makes sure `shows` has a partition for this month and the next `months_ahead`."""
+    month = month_start(date.today())
+    created = []
+    for _ in range(months_ahead + 1):
+        name = partition_name('shows', month)
+        exists = connection.execute(text('SELECT to_regclass(:name) IS NOT NULL'), {'name': name}).scalar()
+        if not exists:
+            # rows for the month may already sit in the default partition, and a
+            # partition can't be attached over them, so move them in first
+            bounds = {'start': month, 'end': next_month(month)}
+            connection.execute(text('CREATE TABLE %s (LIKE shows INCLUDING DEFAULTS)' % name))
+            connection.execute(text(
+                'INSERT INTO %s SELECT * FROM %s WHERE start_time >= :start AND start_time < :end'
+                % (name, HOT_DEFAULT_PARTITION)
+            ), bounds)
+            connection.execute(text(
+                'DELETE FROM %s WHERE start_time >= :start AND start_time < :end' % HOT_DEFAULT_PARTITION
+            ), bounds)
+            connection.execute(text(
+                "ALTER TABLE shows ATTACH PARTITION %s FOR VALUES FROM ('%s') TO ('%s')"
+                % (name, month, next_month(month))
+            ))
+            created.append(name)
+        month = next_month(month)
+    return created
+
+
+def archive_postgres_partitions(connection, cutoff):
+    """Moves every monthly partition of `shows` that ends by `cutoff` to `shows_archive`."""
+    partitions = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'shows'::regclass AND c.relname ~ '^shows_[0-9]{4}_[0-9]{2}$' "
+        "ORDER BY c.relname"
+    ))
+    moved = []
+    for (name,) in list(partitions):
+        year, month = int(name[6:10]), int(name[11:13])
+        start = date(year, month, 1)
+        if next_month(start) > cutoff:
+            break
+        connection.execute(text('ALTER TABLE shows DETACH PARTITION %s' % name))
+        archived = partition_name('shows_archive', start)
+        if connection.execute(text('SELECT to_regclass(:name) IS NOT NULL'), {'name': archived}).scalar():
+            # the archive was partitioned while it already held rows from this
+            # month, so the month's range is taken there: merge the rows in
+            connection.execute(text('INSERT INTO %s SELECT * FROM %s' % (archived, name)))
+            connection.execute(text('DROP TABLE %s' % name))
+        else:
+            connection.execute(text(
+                "ALTER TABLE shows_archive ATTACH PARTITION %s FOR VALUES FROM ('%s') TO ('%s')"
+                % (name, start, next_month(start))
+            ))
+        moved.append(name)
+    return moved
+
+
+def archive_default_rows(connection, cutoff):
+    """Moves shows before `cutoff` out of the default partition of `shows` into `shows_archive`.
+
+    Shows listed for a month whose partition has already been archived (or
+    that never had one) land in the default partition, which no partition
+    move ever carries, so they are moved row by row.
+    """
+    cutoff = datetime.combine(cutoff, datetime.min.time())
+    months = connection.execute(text(
+        "SELECT DISTINCT date_trunc('month', start_time) FROM %s WHERE start_time < :cutoff" % HOT_DEFAULT_PARTITION
+    ), {'cutoff': cutoff})
+    for (month,) in list(months):
+        month = month_start(month)
+        # an archived month is either a partition detached from `shows` or
+        # one the archive was set up with
+        covered = [
+            connection.execute(text('SELECT to_regclass(:name) IS NOT NULL'), {'name': partition_name(table, month)}).scalar()
+            for table in ('shows', 'shows_archive')
+        ]
+        if not any(covered):
+            connection.execute(text(
+                "CREATE TABLE %s PARTITION OF shows_archive FOR VALUES FROM ('%s') TO ('%s')"
+                % (partition_name('shows_archive', month), month, next_month(month))
+            ))
+    connection.execute(text(
+        'INSERT INTO shows_archive (id, start_time, artist_id, venue_id) '
+        'SELECT id, start_time, artist_id, venue_id FROM %s WHERE start_time < :cutoff' % HOT_DEFAULT_PARTITION
+    ), {'cutoff': cutoff})
+    return connection.execute(
+        text('DELETE FROM %s WHERE start_time < :cutoff' % HOT_DEFAULT_PARTITION), {'cutoff': cutoff}
+    ).rowcount
+
+
+def archive_rows(connection, cutoff):
+    """Moves shows before `cutoff` into `shows_archive` row by row, in one transaction."""
+    cutoff = datetime.combine(cutoff, datetime.min.time())
+    connection.execute(text(
+        'INSERT INTO shows_archive (id, start_time, artist_id, venue_id) '
+        'SELECT id, start_time, artist_id, venue_id FROM shows WHERE start_time < :cutoff'
+    ), {'cutoff': cutoff})
+    return connection.execute(text('DELETE FROM shows WHERE start_time < :cutoff'), {'cutoff': cutoff}).rowcount
+
+
+def maintain_shows(engine, archive_after_days, months_ahead):
+    """Creates upcoming partitions and archives old shows. Returns a summary line."""
+    cutoff = archive_cutoff(archive_after_days)
+    with engine.begin() as connection:
+        if engine.dialect.name == 'postgresql':
+            setup_postgres_partitions(connection)
+            created = create_postgres_partitions(connection, months_ahead)
+            moved = archive_postgres_partitions(connection, cutoff)
+            stragglers = archive_default_rows(connection, cutoff)
+            return 'Created %d partitions, archived %d months and %d other shows before %s.' % (
+                len(created), len(moved), stragglers, cutoff)
+        moved = archive_rows(connection, cutoff)
+        return 'Archived %d shows before %s.' % (moved, cutoff)
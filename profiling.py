@@ -0,0 +1,131 @@
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request
+
+
+# Profiles single live requests on demand: a random PROFILE_SAMPLE_RATE of
+# them, or any request carrying the PROFILE_HEADER with PROFILE_TOKEN. While
+# such a request runs, a sampler thread records the request thread's call
+# stack every PROFILE_INTERVAL seconds. The samples are written to
+# PROFILE_DIR in the folded-stack format ("root;caller;callee count"), which
+# flamegraph.pl, speedscope and most flame graph viewers open directly.
+# Requests that aren't profiled only pay for one config lookup.
+
+PROFILE_HEADER = 'X-Fyyur-Profile'
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class StackSampler:
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+
+class RequestProfiler:
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+        app.config.setdefault('PROFILE_TOKEN', None)
+        app.config.setdefault('PROFILE_DIR', 'profiles')
+        app.config.setdefault('PROFILE_KEEP', 50)
+        app.config.setdefault('PROFILE_INTERVAL', 0.001)
+        self.config = app.config
+        app.extensions['request_profiler'] = self
+        app.before_request(self._start)
+        app.after_request(self._name_profile)
+        app.teardown_request(self._finish)
+
+    def sampled(self):
+        rate = self.config['PROFILE_SAMPLE_RATE']
+        return bool(rate and random.random() < rate)
+
+    def authorized(self):
+        token = self.config['PROFILE_TOKEN']
+        supplied = request.headers.get(PROFILE_HEADER)
+        return bool(token and supplied and hmac.compare_digest(supplied.encode(), token.encode()))
+
+    def _start(self):
+        authorized = self.authorized()
+        if not (authorized or self.sampled()):
+            return
+        g.profile_authorized = authorized
+        g.profile_started = time.perf_counter()
+        g.profile_name = '%s-%s-%s.folded' % (
+            datetime.now().strftime('%Y%m%dT%H%M%S%f'), request.endpoint or 'unmatched', os.getpid())
+        g.profile_sampler = StackSampler(threading.get_ident(), self.config['PROFILE_INTERVAL'])
+        g.profile_sampler.start()
+
+    def _name_profile(self, response):
+        # only whoever asked with the token learns where the profile went;
+        # sampled requests are anyone's
+        if 'profile_sampler' in g and g.profile_authorized:
+            response.headers['X-Fyyur-Profile-File'] = g.profile_name
+        return response
+
+    def _finish(self, exception=None):
+        sampler = g.pop('profile_sampler', None)
+        if sampler is None:
+            return
+        samples = sampler.stop()
+        directory = self.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, g.profile_name), 'w') as f:
+            for stack, count in samples.most_common():
+                f.write('%s %d\n' % (stack, count))
+        self._prune(directory)
+        current_app.logger.info('Profiled %s %s in %.1f ms (%d samples): %s', request.method, request.full_path,
+                                (time.perf_counter() - g.profile_started) * 1000, sum(samples.values()),
+                                g.profile_name)
+
+    def _prune(self, directory):
+        profiles = []
+        for entry in os.scandir(directory):
+            if not entry.name.endswith('.folded'):
+                continue
+            try:
+                profiles.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue  # pruned by another worker meanwhile
+        profiles.sort()
+        for _, path in profiles[:max(0, len(profiles) - self.config['PROFILE_KEEP'])]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,215 @@
+import hmac
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from flask import abort, current_app, g, jsonify, request
+
+
+# Every request is put in a route class (search, write, read or thumbnail).
+# Each route has a token bucket per client, refilled at its class's `rate`
+# requests per second up to `burst`, and each class a cap on how many of its
+# requests may run at once. Requests over either limit are turned away immediately with a
+# Retry-After header instead of piling up behind a saturated database.
+
+DEFAULT_RATE_LIMITS = {
+    'search': (2, 10),
+    'write': (1, 5),
+    'read': (20, 60),
+    # a page embeds dozens of thumbnails, so the bucket is deep
+    'thumbnail': (30, 120),
+}
+DEFAULT_CONCURRENCY_LIMITS = {
+    'search': 4,
+    'write': 8,
+    'read': 32,
+    # uncached thumbnails wait on a fetch from another host
+    'thumbnail': 8,
+}
+EXEMPT_ENDPOINTS = ('static',)
+# stats_view only answers requests carrying this header with ADMIN_TOKEN
+ADMIN_HEADER = 'X-Fyyur-Admin'
+
+
+def limit_class(name):
+    """Puts a view in a route class other than the one its method implies."""
+    def decorator(view):
+        view.limit_class = name
+        return view
+    return decorator
+
+
+class MemoryBackend:
+    """Token buckets held in this process; each worker enforces its own limits.
+
+    Buckets are kept least recently used first. Each take drops a couple of
+    buckets from the front if they have refilled completely, and the front
+    one regardless once there are more than `max_keys`, so a take costs the
+    same however many clients have been seen.
+    """
+
+    # refilled buckets dropped per take, more than the one a take can add
+    EVICT_PER_TAKE = 2
+
+    def __init__(self, max_keys=100000):
+        self.buckets = OrderedDict()
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """Takes a token from `key`'s bucket. Returns 0 if allowed, else seconds until one is available."""
+        with self._lock:
+            tokens, updated, _, _ = self.buckets.pop(key, (burst, now, rate, burst))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            # each bucket keeps its own class's rate and burst, so it is
+            # only ever judged refilled by those
+            self.buckets[key] = (tokens, now, rate, burst)
+            self._evict(now)
+            return wait
+
+    def _evict(self, now):
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        for _ in range(self.EVICT_PER_TAKE):
+            key, (tokens, updated, rate, burst) = next(iter(self.buckets.items()))
+            if tokens + (now - updated) * rate < burst:
+                break
+            # a full bucket holds no state worth keeping
+            del self.buckets[key]
+
+
+class RedisBackend:
+    """Token buckets shared by every worker through a Redis server.
+
+    Takes an existing `redis.Redis` client, so redis is only needed when
+    this backend is actually configured.
+    """
+
+    SCRIPT = '''
+    local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + (now - updated) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    '''
+
+    def __init__(self, client, prefix='fyyur:ratelimit:'):
+        self.prefix = prefix
+        self.script = client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst, now):
+        return float(self.script(keys=[self.prefix + ':'.join(key)], args=[rate, burst, now]))
+
+
+class AdmissionControl:
+
+    def __init__(self, app=None, backend=None):
+        self.backend = backend
+        self.counters = Counter()
+        self.in_flight = Counter()
+        self.semaphores = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATE_LIMITS', DEFAULT_RATE_LIMITS)
+        app.config.setdefault('CONCURRENCY_LIMITS', DEFAULT_CONCURRENCY_LIMITS)
+        app.config.setdefault('RATELIMIT_REDIS_URL', None)
+        app.config.setdefault('ADMIN_TOKEN', None)
+        if self.backend is None:
+            if app.config['RATELIMIT_REDIS_URL']:
+                import redis
+                self.backend = RedisBackend(redis.Redis.from_url(app.config['RATELIMIT_REDIS_URL']))
+            else:
+                self.backend = MemoryBackend()
+        self.semaphores = {
+            name: threading.BoundedSemaphore(limit)
+            for name, limit in app.config['CONCURRENCY_LIMITS'].items()
+        }
+        app.extensions['admission_control'] = self
+        app.before_request(self._admit)
+        app.teardown_request(self._release)
+
+    def route_class(self):
+        view = current_app.view_functions.get(request.endpoint)
+        name = getattr(view, 'limit_class', None)
+        if name is not None:
+            return name
+        return 'read' if request.method in ('GET', 'HEAD') else 'write'
+
+    def _count(self, name, outcome):
+        with self._lock:
+            self.counters[name, outcome] += 1
+
+    def _admit(self):
+        if request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        name = self.route_class()
+
+        limit = current_app.config['RATE_LIMITS'].get(name)
+        if limit is not None:
+            rate, burst = limit
+            # behind a proxy remote_addr is the proxy's, unless TRUSTED_PROXIES is set
+            key = (name, request.endpoint or '-', request.remote_addr or '-')
+            wait = self.backend.take(key, rate, burst, time.time())
+            if wait > 0:
+                self._count(name, 'rate_limited')
+                return self._reject(429, 'Too many requests, slow down.', wait)
+
+        semaphore = self.semaphores.get(name)
+        if semaphore is not None:
+            if not semaphore.acquire(blocking=False):
+                self._count(name, 'shed')
+                return self._reject(503, 'Server busy, try again shortly.', 1)
+            g.admitted_class = name
+            with self._lock:
+                self.in_flight[name] += 1
+        self._count(name, 'admitted')
+        return None
+
+    def _release(self, exception=None):
+        name = g.pop('admitted_class', None)
+        if name is not None:
+            with self._lock:
+                self.in_flight[name] -= 1
+            self.semaphores[name].release()
+
+    def _reject(self, status, message, retry_after):
+        response = current_app.make_response((message, status))
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for (name, outcome), count in self.counters.items():
+                stats.setdefault(name, {})[outcome] = count
+            for name, count in self.in_flight.items():
+                stats.setdefault(name, {})['in_flight'] = count
+            return stats
+
+    def stats_view(self):
+        # a 404 rather than a 403, and always without a token configured
+        token = current_app.config['ADMIN_TOKEN']
+        supplied = request.headers.get(ADMIN_HEADER)
+        if not (token and supplied and hmac.compare_digest(supplied.encode(), token.encode())):
+            abort(404)
+        return jsonify(stats=self.stats(),
+                       rate_limits=current_app.config['RATE_LIMITS'],
+                       concurrency_limits=current_app.config['CONCURRENCY_LIMITS'])
@@ -0,0 +1,164 @@
+import itertools
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event, orm, text
+from sqlalchemy.exc import DatabaseError
+
+try:
+    from flask_sqlalchemy import SignallingSession
+except ImportError:  # Flask-SQLAlchemy 3.x
+    from flask_sqlalchemy.session import Session as SignallingSession
+
+
+# Reads go to the replicas listed in SQLALCHEMY_REPLICA_URIS, everything
+# else (writes, and any request from a client that wrote recently) goes to
+# the primary in SQLALCHEMY_DATABASE_URI.
+
+STICKY_COOKIE = 'fyyur_primary'
+READ_METHODS = ('GET', 'HEAD')
+
+
+def read_only(view):
+    """Marks a non-GET view (e.g. a search form POST) as safe to serve from a replica."""
+    view.read_only = True
+    return view
+
+
+class Replica:
+
+    def __init__(self, uri, engine_options, check_interval, retry_seconds):
+        self.uri = uri
+        self.engine = create_engine(uri, **engine_options)
+        self.check_interval = check_interval
+        self.retry_seconds = retry_seconds
+        self.down_until = 0.0
+        self.checked_at = 0.0
+        event.listen(self.engine, 'handle_error', self._on_error)
+
+    def _on_error(self, context):
+        # only the replica's own failures take it out of rotation: a dropped
+        # connection, or one that can't be made (no connection in the
+        # context). A query that fails by itself (bad SQL, a statement
+        # timeout) would fail on every replica in turn and empty them all.
+        if context.is_disconnect or context.connection is None:
+            self.down_until = time.monotonic() + self.retry_seconds
+
+    def is_down(self):
+        return time.monotonic() < self.down_until
+
+    def is_healthy(self):
+        now = time.monotonic()
+        if now < self.down_until:
+            return False
+        if now - self.checked_at >= self.check_interval:
+            self.checked_at = now
+            try:
+                with self.engine.connect() as connection:
+                    connection.execute(text('SELECT 1'))
+            except Exception:
+                self.down_until = now + self.retry_seconds
+                return False
+        return True
+
+
+class ReplicaRouter:
+    """Round-robins reads across healthy replicas and pins writers to the primary."""
+
+    def __init__(self, app=None):
+        self.replicas = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+        app.config.setdefault('REPLICA_HEALTH_CHECK_SECONDS', 5)
+        app.config.setdefault('REPLICA_RETRY_SECONDS', 30)
+        engine_options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        self.replicas = [
+            Replica(uri, engine_options,
+                    app.config['REPLICA_HEALTH_CHECK_SECONDS'],
+                    app.config['REPLICA_RETRY_SECONDS'])
+            for uri in app.config['SQLALCHEMY_REPLICA_URIS']
+        ]
+        app.extensions['replicas'] = self
+        app.before_request(self._route_request)
+        app.after_request(self._stick_writer)
+        app.register_error_handler(DatabaseError, self._retry_on_primary)
+
+    def pick(self):
+        """Returns the next healthy replica's engine, or None to fall back to the primary."""
+        with self._lock:
+            start = next(self._counter)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.is_healthy():
+                return replica.engine
+        return None
+
+    def engine_for_request(self):
+        """The replica engine serving this request, picked once so all its reads see one replica."""
+        if 'replica_engine' not in g:
+            g.replica_engine = self.pick()
+        return g.replica_engine
+
+    def _route_request(self):
+        view = current_app.view_functions.get(request.endpoint)
+        g.read_only = (
+            bool(self.replicas)
+            and (request.method in READ_METHODS or getattr(view, 'read_only', False))
+            and STICKY_COOKIE not in request.cookies
+        )
+
+    def _retry_on_primary(self, error):
+        # when the replica serving this read went down under it, the view
+        # (which only reads) is run again against the primary. Any other
+        # error is the query's own and would fail there just the same.
+        engine = g.get('replica_engine')
+        if not any(replica.engine is engine and replica.is_down() for replica in self.replicas):
+            raise error
+        g.replica_engine = None
+        g.read_only = False
+        state = current_app.extensions['sqlalchemy']
+        getattr(state, 'db', state).session.rollback()  # Flask-SQLAlchemy 2.x keeps the db on a state object
+        return current_app.view_functions[request.endpoint](**request.view_args)
+
+    def _stick_writer(self, response):
+        # a client that just wrote keeps reading from the primary for a
+        # little while, so it never sees a replica that hasn't caught up
+        view = current_app.view_functions.get(request.endpoint)
+        if request.method not in READ_METHODS and not getattr(view, 'read_only', False):
+            response.set_cookie(
+                STICKY_COOKIE, '1',
+                max_age=current_app.config['REPLICA_STICKY_SECONDS'],
+                httponly=True
+            )
+        return response
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if has_request_context() and g.get('read_only') and not self._flushing:
+            router = current_app.extensions.get('replicas')
+            engine = router.engine_for_request() if router is not None else None
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause, **kwargs)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def __init__(self, *args, **kwargs):
+        session_options = kwargs.setdefault('session_options', {})
+        session_options.setdefault('class_', RoutingSession)
+        super().__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        # Flask-SQLAlchemy 2.x hard-codes its session class here
+        return orm.sessionmaker(db=self, **options)
@@ -0,0 +1,87 @@
+"""Runs the app itself against a scratch SQLite database.
+
+The settings are written before any test imports app.py, which reads
+FYYUR_SETTINGS once at import. Each test using `client` starts from empty
+tables and empty in-memory indexes.
+"""
+import json
+import os
+import tempfile
+
+import pytest
+
+SCRATCH = tempfile.mkdtemp(prefix='fyyur-tests-')
+SETTINGS = os.path.join(SCRATCH, 'settings.cfg')
+
+with open(SETTINGS, 'w') as settings:
+    settings.write('\n'.join([
+        'SQLALCHEMY_DATABASE_URI = %r' % ('sqlite:///' + os.path.join(SCRATCH, 'fyyur.db')),
+        'WTF_CSRF_ENABLED = False',
+        # every request comes from the same test client
+        'RATE_LIMITS = {}',
+        'ACCESS_LOG = %r' % os.path.join(SCRATCH, 'access.log'),
+        'ERROR_LOG = %r' % os.path.join(SCRATCH, 'error.log'),
+        'THUMBNAIL_DIR = %r' % os.path.join(SCRATCH, 'thumbnails'),
+        'PROFILE_DIR = %r' % os.path.join(SCRATCH, 'profiles'),
+    ]))
+os.environ['FYYUR_SETTINGS'] = SETTINGS
+
+
+@pytest.fixture
+def fyyur(monkeypatch):
+    import app as fyyur
+    from geo import VenueIndex
+    from matchmaking import Matchmaker
+
+    monkeypatch.setattr(fyyur, 'venue_index', VenueIndex())
+    monkeypatch.setattr(fyyur, 'matchmaker', Matchmaker())
+    with fyyur.app.app_context():
+        fyyur.db.drop_all()
+        fyyur.db.create_all()
+        yield fyyur
+        fyyur.db.session.remove()
+
+
+@pytest.fixture
+def client(fyyur):
+    return fyyur.app.test_client()
+
+
+@pytest.fixture
+def add_artist(fyyur):
+    def add_artist(name, genres='Jazz', city='San Francisco', state='CA', **columns):
+        artist = fyyur.Artist(
+            name=name, genres=genres, city=city, state=state, phone=name,
+            image_link='https://example.com/%s.png' % name, **columns
+        )
+        fyyur.db.session.add(artist)
+        fyyur.db.session.commit()
+        return artist.id
+    return add_artist
+
+
+@pytest.fixture
+def add_venue(fyyur):
+    def add_venue(name, genres='Jazz', city='San Francisco', state='CA', **columns):
+        venue = fyyur.Venue(
+            name=name, genres=genres, city=city, state=state, phone=name, address='1 Main St',
+            image_link='https://example.com/%s.png' % name, **columns
+        )
+        fyyur.db.session.add(venue)
+        fyyur.db.session.commit()
+        return venue.id
+    return add_venue
+
+
+@pytest.fixture
+def edit_form(fyyur):
+    def edit_form(record, **changes):
+        """The edit form as it is rendered for `record` and then submitted with `changes`."""
+        fields = fyyur.ARTIST_FIELDS if isinstance(record, fyyur.Artist) else fyyur.VENUE_FIELDS
+        original = {field: getattr(record, field) for field in fields}
+        original = {field: '' if value is None else value for field, value in original.items()}
+        data = dict(original, genres=record.genres.split(','), version=record.version, original=json.dumps(original))
+        data.update(changes)
+        # an unticked checkbox isn't submitted at all
+        return {field: value for field, value in data.items() if value is not False}
+    return edit_form
@@ -0,0 +1,170 @@
+from datetime import date, datetime
+
+import pytest
+
+from analytics import backfill_rollups, dashboard, rollup_deltas
+from models import ArchivedShow, Show, ShowRollup, db
+
+
+def rollups():
+    return {
+        (row.dimension, row.label, row.month): row.count
+        for row in db.session.query(ShowRollup) if row.count
+    }
+
+
+def assert_rollups_match_backfill():
+    kept = rollups()
+    db.session.commit()
+    backfill_rollups(db.engine)
+    assert kept == rollups()
+    return kept
+
+
+def test_rollup_deltas():
+    deltas = rollup_deltas([
+        (datetime(2026, 3, 5, 20), 'San Francisco', 'CA', 'Jazz, Blues,Jazz'),
+        (datetime(2026, 3, 28, 21), 'Austin', 'TX', ''),
+    ], sign=-1)
+    assert deltas == {
+        ('all', '', date(2026, 3, 1)): -2,
+        ('city', 'San Francisco, CA', date(2026, 3, 1)): -1,
+        ('city', 'Austin, TX', date(2026, 3, 1)): -1,
+        ('genre', 'Blues', date(2026, 3, 1)): -1,
+        ('genre', 'Jazz', date(2026, 3, 1)): -1,
+    }
+
+
+def test_create_show_counts_it(client, add_artist, add_venue):
+    artist_id = add_artist('Guns N Petals', genres='Rock n Roll,Jazz')
+    venue_id = add_venue('The Musical Hop')
+    client.post('/shows/create', data={
+        'artist_id': artist_id, 'venue_id': venue_id, 'start_time': '2026-11-20 20:00:00',
+    })
+    assert assert_rollups_match_backfill() == {
+        ('all', '', date(2026, 11, 1)): 1,
+        ('city', 'San Francisco, CA', date(2026, 11, 1)): 1,
+        ('genre', 'Jazz', date(2026, 11, 1)): 1,
+        ('genre', 'Rock n Roll', date(2026, 11, 1)): 1,
+    }
+
+
+def test_tour_counts_every_listed_show(client, add_artist, add_venue):
+    artist_id = add_artist('Matt Quevedo')
+    first = add_venue('The Musical Hop')
+    second = add_venue('The Dueling Pianos Bar', city='New York', state='NY')
+    client.post('/shows/create/tour', data={
+        'artist_id': artist_id,
+        'shows': '%d, 2026-11-20 20:00\n%d, 2026-12-01 21:00\n999, 2026-12-02 21:00' % (first, second),
+    })
+    assert Show.query.count() == 2
+    kept = assert_rollups_match_backfill()
+    assert kept[('all', '', date(2026, 11, 1))] == 1
+    assert kept[('city', 'New York, NY', date(2026, 12, 1))] == 1
+
+
+def test_delete_venue_uncounts_its_shows(client, add_artist, add_venue):
+    artist_id = add_artist('The Wild Sax Band')
+    kept_venue = add_venue('The Musical Hop')
+    deleted_venue = add_venue('Park Square Live Music & Coffee', city='Austin', state='TX')
+    for venue_id, start_time in ((kept_venue, '2026-11-20 20:00'), (deleted_venue, '2026-11-21 20:00')):
+        client.post('/shows/create/tour', data={'artist_id': artist_id, 'shows': '%d, %s' % (venue_id, start_time)})
+    db.session.add(ArchivedShow(artist_id=artist_id, venue_id=deleted_venue, start_time=datetime(2025, 1, 10, 20)))
+    db.session.commit()
+    backfill_rollups(db.engine)
+
+    client.delete('/venues/%d' % deleted_venue)
+    assert assert_rollups_match_backfill() == {
+        ('all', '', date(2026, 11, 1)): 1,
+        ('city', 'San Francisco, CA', date(2026, 11, 1)): 1,
+        ('genre', 'Jazz', date(2026, 11, 1)): 1,
+    }
+
+
+def test_venue_moving_city_moves_its_shows(fyyur, client, add_artist, add_venue, edit_form):
+    artist_id = add_artist('Guns N Petals')
+    venue_id = add_venue('The Musical Hop')
+    client.post('/shows/create/tour', data={'artist_id': artist_id, 'shows': '%d, 2026-11-20 20:00' % venue_id})
+    client.post('/venues/%d/edit' % venue_id, data=edit_form(fyyur.Venue.query.get(venue_id), city='Oakland'))
+    kept = assert_rollups_match_backfill()
+    assert kept[('city', 'Oakland, CA', date(2026, 11, 1))] == 1
+    assert ('city', 'San Francisco, CA', date(2026, 11, 1)) not in kept
+
+
+def test_artist_changing_genres_moves_its_shows(fyyur, client, add_artist, add_venue, edit_form):
+    artist_id = add_artist('Guns N Petals', genres='Jazz')
+    venue_id = add_venue('The Musical Hop')
+    client.post('/shows/create/tour', data={'artist_id': artist_id, 'shows': '%d, 2026-11-20 20:00' % venue_id})
+    client.post('/artists/%d/edit' % artist_id, data=edit_form(fyyur.Artist.query.get(artist_id), genres=['Blues', 'Soul']))
+    kept = assert_rollups_match_backfill()
+    assert kept[('genre', 'Blues', date(2026, 11, 1))] == 1
+    assert kept[('genre', 'Soul', date(2026, 11, 1))] == 1
+    assert ('genre', 'Jazz', date(2026, 11, 1)) not in kept
+
+
+@pytest.fixture
+def known_rollups(fyyur):
+    for dimension, label, month, count in [
+        ('all', '', date(2025, 3, 1), 10),
+        ('all', '', date(2025, 12, 1), 2),
+        ('all', '', date(2026, 1, 1), 4),
+        ('all', '', date(2026, 3, 1), 6),
+        ('city', 'Old Town, XX', date(2025, 3, 1), 10),
+        ('city', 'Austin, TX', date(2026, 1, 1), 1),
+        ('city', 'San Francisco, CA', date(2026, 1, 1), 3),
+        ('city', 'San Francisco, CA', date(2026, 3, 1), 2),
+        ('city', 'New York, NY', date(2026, 3, 1), 4),
+        ('city', 'Emptied, XX', date(2026, 3, 1), 0),
+        ('genre', 'Jazz', date(2026, 1, 1), 4),
+        ('genre', 'Jazz', date(2026, 3, 1), 3),
+        ('genre', 'Rock n Roll', date(2026, 3, 1), 3),
+    ]:
+        db.session.add(ShowRollup(dimension=dimension, label=label, month=month, count=count))
+    db.session.commit()
+
+
+def test_dashboard_growth(known_rollups):
+    data = dashboard(db.session, datetime(2026, 3, 15), 3, 2)
+    assert data['months'] == ['2026-01', '2026-02', '2026-03']
+    assert data['shows'] == [4, 0, 6]
+    assert data['total'] == 10
+    # February had no shows to grow from, nor did January or February a year before
+    assert data['month_over_month'] == [1.0, -1.0, None]
+    assert data['year_over_year'] == [None, None, -0.4]
+
+
+def test_dashboard_top_cities(known_rollups):
+    data = dashboard(db.session, datetime(2026, 3, 15), 3, 2)
+    assert data['top_cities'] == [
+        {'city': 'San Francisco, CA', 'shows': 5, 'share': 0.5, 'series': [3, 0, 2]},
+        {'city': 'New York, NY', 'shows': 4, 'share': 0.4, 'series': [0, 0, 4]},
+    ]
+
+
+def test_dashboard_genre_shares(known_rollups):
+    data = dashboard(db.session, datetime(2026, 3, 15), 3, 2)
+    assert data['genres'] == [
+        {'genre': 'Jazz', 'shows': 7, 'share': 0.7, 'series': [1.0, None, 0.5]},
+        {'genre': 'Rock n Roll', 'shows': 3, 'share': 0.3, 'series': [0.0, None, 0.5]},
+    ]
+
+
+def test_dashboard_without_shows(fyyur):
+    data = dashboard(db.session, datetime(2026, 3, 15), 2, 5)
+    assert data['shows'] == [0, 0]
+    assert data['month_over_month'] == [None, None]
+    assert data['top_cities'] == [] and data['genres'] == []
+
+
+@pytest.mark.parametrize('query, status', [
+    ('', 200),
+    ('?until=2026-03&months=3&top=2', 200),
+    ('?until=1900-01&months=1000', 200),
+    ('?until=0001-01', 400),
+    ('?until=1899-12', 400),
+    ('?until=2026-13', 400),
+    ('?until=March', 400),
+])
+def test_analytics_window_bounds(client, query, status):
+    assert client.get('/analytics.json' + query).status_code == status
+    assert client.get('/analytics' + query).status_code == status
@@ -0,0 +1,60 @@
+"""Archiving on SQLite, where `flask maintain-shows` moves rows between two plain tables."""
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import ArchivedShow, Show, db
+from partitions import archive_cutoff, maintain_shows
+
+
+@pytest.fixture
+def shows(fyyur, add_artist, add_venue):
+    artist_id = add_artist('Guns N Petals')
+    venue_id = add_venue('The Musical Hop')
+    now = datetime.now()
+    for start_time in (
+        datetime(2019, 5, 21, 21, 30),
+        now - timedelta(days=400),
+        now - timedelta(days=2),
+        now + timedelta(days=30),
+    ):
+        db.session.add(Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time))
+    db.session.commit()
+    maintain_shows(db.engine, 90, 3)
+    db.session.add(Show(artist_id=artist_id, venue_id=venue_id, start_time=now - timedelta(days=1)))
+    db.session.commit()
+    return artist_id, venue_id
+
+
+def test_old_shows_move_to_the_archive(shows):
+    cutoff = datetime.combine(archive_cutoff(90), datetime.min.time())
+    hot = Show.query.all()
+    archived = ArchivedShow.query.all()
+    assert all(show.start_time >= cutoff for show in hot)
+    assert all(show.start_time < cutoff for show in archived)
+    # archived shows keep their ids, and those are never handed out again
+    assert sorted(show.id for show in archived) == [1, 2]
+    assert sorted(show.id for show in hot) == [3, 4, 5]
+
+
+def test_maintenance_is_repeatable(shows):
+    assert maintain_shows(db.engine, 90, 3).startswith('Archived 0 shows')
+    assert (Show.query.count(), ArchivedShow.query.count()) == (3, 2)
+
+
+def past_shows(page):
+    count = int(re.search(r'(\d+) Past Show', page).group(1))
+    years = re.findall(r'(\d{4}) at', page.split('Past Show', 1)[1])
+    return count, years
+
+
+@pytest.mark.parametrize('path', ['/venues/%(venue_id)d', '/artists/%(artist_id)d'])
+def test_pages_list_archived_and_hot_past_shows(client, shows, path):
+    artist_id, venue_id = shows
+    page = client.get(path % {'artist_id': artist_id, 'venue_id': venue_id}).get_data(as_text=True)
+    count, years = past_shows(page)
+    assert count == 4
+    # oldest first, across both tables
+    assert years[0] == '2019' and years == sorted(years)
+    assert '1 Upcoming Show' in page
@@ -0,0 +1,72 @@
+import pytest
+from sqlalchemy import event
+
+from models import Artist, Venue, db
+
+
+@pytest.fixture
+def updates(fyyur):
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('UPDATE'):
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def test_only_changed_fields_are_written(client, add_artist, edit_form, updates):
+    artist_id = add_artist('Guns N Petals', seeking_venue=True)
+    client.post('/artists/%d/edit' % artist_id, data=edit_form(Artist.query.get(artist_id), city='Oakland'))
+    artist = Artist.query.get(artist_id)
+    assert (artist.city, artist.seeking_venue, artist.version) == ('Oakland', True, 2)
+    assert len(updates) == 1
+    assert 'city' in updates[0] and 'name' not in updates[0]
+
+
+def test_stale_version_is_a_conflict(client, add_artist, edit_form, updates):
+    artist_id = add_artist('Guns N Petals')
+    stale = edit_form(Artist.query.get(artist_id), city='Oakland')
+    client.post('/artists/%d/edit' % artist_id, data=edit_form(Artist.query.get(artist_id), state='NV'))
+    updates.clear()
+
+    response = client.post('/artists/%d/edit' % artist_id, data=stale)
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/artists/%d/edit' % artist_id)
+    artist = Artist.query.get(artist_id)
+    assert (artist.city, artist.state, artist.version) == ('San Francisco', 'NV', 2)
+    # the guarded UPDATE matched no row
+    assert len(updates) == 1
+
+
+@pytest.mark.parametrize('version', [None, '', 'x'])
+def test_missing_version_is_a_conflict(client, add_venue, edit_form, version):
+    venue_id = add_venue('The Musical Hop')
+    data = edit_form(Venue.query.get(venue_id), city='Oakland')
+    if version is None:
+        del data['version']
+    else:
+        data['version'] = version
+
+    response = client.post('/venues/%d/edit' % venue_id, data=data)
+    assert response.headers['Location'].endswith('/venues/%d/edit' % venue_id)
+    venue = Venue.query.get(venue_id)
+    assert (venue.city, venue.version) == ('San Francisco', 1)
+
+
+def test_unchanged_save_writes_nothing(client, add_venue, edit_form, updates):
+    venue_id = add_venue('The Musical Hop', seeking_talent=True, seeking_description=None)
+    response = client.post('/venues/%d/edit' % venue_id, data=edit_form(Venue.query.get(venue_id)))
+    assert response.headers['Location'].endswith('/venues/%d' % venue_id)
+    assert updates == []
+    assert Venue.query.get(venue_id).version == 1
+
+
+def test_reordered_genres_are_unchanged(client, add_artist, edit_form, updates):
+    artist_id = add_artist('Guns N Petals', genres='Rock n Roll,Jazz')
+    client.post('/artists/%d/edit' % artist_id, data=edit_form(Artist.query.get(artist_id), genres=['Jazz', 'Rock n Roll']))
+    assert updates == []
+    artist = Artist.query.get(artist_id)
+    assert (artist.genres, artist.version) == ('Rock n Roll,Jazz', 1)
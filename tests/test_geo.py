@@ -0,0 +1,183 @@
+import random
+import threading
+
+import pytest
+
+from geo import GridIndex, VenueIndex, city_centroid, haversine_km
+
+CELL_SIZES = (0.5, 1.0, 2.0, 5.0, 0.25)
+
+
+def brute_force(points, lat, lon):
+    return sorted((haversine_km(lat, lon, plat, plon), key) for key, (plat, plon) in points.items())
+
+
+def random_index(seed, n=2000, cell_degrees=0.5):
+    rng = random.Random(seed)
+    index = GridIndex(cell_degrees)
+    points = {}
+    for key in range(n):
+        # cluster some points at the poles and along the antimeridian
+        kind = rng.random()
+        if kind < 0.2:
+            lat, lon = rng.uniform(85, 90) * rng.choice((1, -1)), rng.uniform(-180, 180)
+        elif kind < 0.4:
+            lat, lon = rng.uniform(-60, 60), rng.choice((rng.uniform(179, 180), rng.uniform(-180, -179)))
+        else:
+            lat, lon = rng.uniform(-90, 90), rng.uniform(-180, 180)
+        points[key] = (lat, lon)
+        index.add(key, lat, lon)
+    return index, points, rng
+
+
+def test_within_across_antimeridian():
+    index = GridIndex()
+    index.add('east', 0, 179.9)
+    assert [key for _, key in index.within(0, -179.9, 50)] == ['east']
+    assert [key for _, key in index.nearest(0, -179.9, 1)] == ['east']
+
+
+def test_within_at_the_pole():
+    index = GridIndex()
+    index.add('across', 89.8, 10)
+    assert [key for _, key in index.within(89.8, -170, 50)] == ['across']
+    assert [key for _, key in index.nearest(89.8, -170, 1)] == ['across']
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_within_matches_brute_force(seed):
+    index, points, rng = random_index(seed)
+    for _ in range(50):
+        lat, lon = rng.uniform(-90, 90), rng.choice((rng.uniform(-180, 180), rng.uniform(179, 180), -180.0))
+        if rng.random() < 0.3:
+            lat = rng.uniform(80, 90) * rng.choice((1, -1))
+        km = rng.choice((5, 50, 300, 2000))
+        expected = [key for distance, key in brute_force(points, lat, lon) if distance <= km]
+        assert sorted(key for _, key in index.within(lat, lon, km)) == sorted(expected)
+
+
+@pytest.mark.parametrize('seed', range(len(CELL_SIZES)))
+def test_nearest_matches_brute_force(seed):
+    index, points, rng = random_index(seed, cell_degrees=CELL_SIZES[seed])
+    for _ in range(50):
+        lat, lon = rng.uniform(-90, 90), rng.uniform(-180, 180)
+        if rng.random() < 0.3:
+            lat = rng.uniform(80, 90) * rng.choice((1, -1))
+        k = rng.choice((1, 5, 20))
+        expected = [distance for distance, _ in brute_force(points, lat, lon)[:k]]
+        assert [distance for distance, _ in index.nearest(lat, lon, k)] == pytest.approx(expected)
+
+
+def test_nearest_with_few_points_returns_them_all():
+    index = GridIndex()
+    index.add('a', 10, 10)
+    index.add('b', -89, 179)
+    assert [key for _, key in index.nearest(0, 0, 5)] == ['a', 'b']
+
+
+class Column:
+
+    def isnot(self, other):
+        return None
+
+
+class Venues:
+    id, latitude, longitude = Column(), Column(), Column()
+
+
+class SlowSession:
+    """Serves `rows` for the venue query, holding it until `release` is set."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def query(self, *columns):
+        self.queries += 1
+        return self
+
+    def filter(self, *criteria):
+        return self
+
+    def __iter__(self):
+        self.reading.set()
+        self.release.wait(5)
+        return iter(self.rows)
+
+
+def test_one_reload_at_a_time_and_edits_survive_it():
+    index = VenueIndex(ttl=0)
+    index.add('old', 10, 10)
+    index.loaded_at = 0.0
+    session = SlowSession([('old', 10, 10), ('listed elsewhere', 20, 20)])
+    reload = threading.Thread(target=index.ensure_loaded, args=(session, Venues))
+    reload.start()
+    assert session.reading.wait(5)
+
+    # meanwhile other requests search the index as it was, without reloading
+    index.ensure_loaded(session, Venues)
+    assert [key for _, key in index.nearest(10, 10, 5)] == ['old']
+    index.add('listed here', 30, 30)
+    index.remove('old')
+
+    session.release.set()
+    reload.join(5)
+    assert session.queries == 1
+    assert sorted(index.points) == ['listed elsewhere', 'listed here']
+
+
+def test_first_load_is_waited_for():
+    index = VenueIndex()
+    session = SlowSession([(1, 10, 10)])
+    first = threading.Thread(target=index.ensure_loaded, args=(session, Venues))
+    first.start()
+    assert session.reading.wait(5)
+    waiting = threading.Thread(target=index.ensure_loaded, args=(session, Venues))
+    waiting.start()
+    session.release.set()
+    first.join(5)
+    waiting.join(5)
+    assert session.queries == 1
+    assert list(index.points) == [1]
+
+
+@pytest.fixture
+def bay_area(add_venue):
+    for name, city, state in (
+        ('The Musical Hop', 'San Francisco', 'CA'),
+        ('The Dueling Pianos Bar', 'Oakland', 'CA'),
+        ('Park Square Live Music & Coffee', 'New York', 'NY'),
+    ):
+        latitude, longitude = city_centroid(city, state)
+        add_venue(name, city=city, state=state, latitude=latitude, longitude=longitude)
+
+
+def test_venues_near_a_city(client, bay_area):
+    page = client.get('/venues/near?city=San Francisco&state=CA&km=30').get_data(as_text=True)
+    assert 'The Musical Hop' in page and 'The Dueling Pianos Bar' in page
+    assert 'Park Square' not in page
+    page = client.get('/venues/near?city=Atlantis&state=XX').get_data(as_text=True)
+    assert 'near unknown location' in page
+
+
+def test_nearest_venues(client, bay_area):
+    page = client.get('/venues/near?lat=40.7&lng=-74.0&k=1').get_data(as_text=True)
+    assert 'Park Square' in page and 'The Musical Hop' not in page
+
+
+def test_venues_near_are_bounded(fyyur, client, bay_area, monkeypatch):
+    assert '100 nearest' in client.get('/venues/near?lat=37.7&lng=-122.4&k=1000000000').get_data(as_text=True)
+    assert 'within 500 km' in client.get('/venues/near?lat=37.7&lng=-122.4&km=20000').get_data(as_text=True)
+    monkeypatch.setattr(fyyur, 'NEAR_LIMIT', 1)
+    page = client.get('/venues/near?lat=37.7749&lng=-122.4194&km=50').get_data(as_text=True)
+    assert 'The Musical Hop' in page and 'The Dueling Pianos Bar' not in page
+
+
+@pytest.mark.parametrize('query', [
+    'lat=37.7&lng=-122.4&km=-1', 'lat=37.7&lng=-122.4&km=nan', 'lat=37.7&lng=-122.4&k=-1',
+    'lat=nan&lng=-122.4', 'lat=37.7&lng=inf', 'lat=91&lng=0',
+])
+def test_bad_venues_near_queries(client, query):
+    assert client.get('/venues/near?' + query).status_code == 400
@@ -0,0 +1,162 @@
+import random
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import matchmaking
+from matchmaking import (
+    ACTIVITY_CAP, ACTIVITY_WEIGHT, GENRE_WEIGHT, RECENT_DAYS, SAME_CITY_WEIGHT, SAME_STATE_WEIGHT,
+    UPCOMING_DAYS, Catalog, Matchmaker, activity_window, split_genres,
+)
+from models import Artist, Show, Venue
+
+
+def test_add_show_counts_only_the_activity_window():
+    matchmaker = Matchmaker()
+    now = datetime.now()
+    matchmaker.add_show(1, 1, now - timedelta(days=1))
+    matchmaker.add_show(1, 1, now + timedelta(days=1))
+    matchmaker.add_show(1, 1, now - timedelta(days=RECENT_DAYS + 1))
+    matchmaker.add_show(1, 2, now + timedelta(days=UPCOMING_DAYS + 1))
+    matchmaker.add_show(1, 2, datetime(2019, 5, 1))
+    matchmaker.add_show(1, 2, datetime(2035, 5, 1))
+    assert matchmaker.artist_activity[1] == 2
+    assert matchmaker.venue_activity == {1: 2}
+
+
+def test_distant_tour_does_not_max_out_activity():
+    matchmaker = Matchmaker()
+    tour_start = datetime(2035, 1, 1)
+    for day in range(40):
+        matchmaker.add_show(1, day, tour_start + timedelta(days=day))
+    assert matchmaker.artist_activity[1] == 0
+
+
+GENRES = ['Jazz', 'Blues', 'Soul', 'Funk', 'Rock n Roll', 'Folk', 'Hip-Hop', 'Classical', 'Country', 'Reggae']
+PLACES = [('San Francisco', 'CA'), ('Oakland', 'CA'), ('New York', 'NY'), ('Buffalo', 'NY'), ('Austin', 'TX')]
+
+
+def random_matchmaker(rng, size):
+    matchmaker = Matchmaker()
+    entities = {'artists': {}, 'venues': {}}
+    for kind, put, activity in (
+        ('artists', matchmaker.put_artist, matchmaker.artist_activity),
+        ('venues', matchmaker.put_venue, matchmaker.venue_activity),
+    ):
+        for key in rng.sample(range(1, size * 3), size):
+            genres = ','.join(rng.sample(GENRES, rng.randint(0, 4)))
+            city, state = rng.choice(PLACES)
+            seeking = rng.random() < 0.7
+            put(key, genres, city, state, seeking)
+            entities[kind][key] = (split_genres(genres), city.lower(), state, seeking)
+            activity[key] = rng.choice((0, 0, 1, 3, 9, 10, 25))
+    return matchmaker, entities
+
+
+def brute_force(source, targets, activity, limit):
+    genres, city, state, _ = source
+    scored = []
+    for key, (target_genres, target_city, target_state, seeking) in targets.items():
+        shared = len(genres & target_genres)
+        if not seeking or not shared:
+            continue
+        score = GENRE_WEIGHT * shared / len(genres)
+        if (target_city, target_state) == (city, state):
+            score += SAME_CITY_WEIGHT
+        elif target_state == state:
+            score += SAME_STATE_WEIGHT
+        score += ACTIVITY_WEIGHT * min(activity.get(key, 0), ACTIVITY_CAP) / ACTIVITY_CAP
+        scored.append((round(score, 3), key))
+    return sorted(scored, reverse=True)[:limit]
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_ranking_matches_brute_force(seed):
+    rng = random.Random(seed)
+    matchmaker, entities = random_matchmaker(rng, rng.choice((20, 200, 1000)))
+    for limit in (1, 5, 20, 10000):
+        for artist_id, artist in entities['artists'].items():
+            expected = brute_force(artist, entities['venues'], matchmaker.venue_activity, limit) if artist[0] else []
+            assert matchmaker.venues_for_artist(artist_id, limit) == expected
+        for venue_id, venue in list(entities['venues'].items())[:50]:
+            expected = brute_force(venue, entities['artists'], matchmaker.artist_activity, limit) if venue[0] else []
+            assert matchmaker.artists_for_venue(venue_id, limit) == expected
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_overlaps_count_shared_genres(seed):
+    rng = random.Random(seed)
+    catalog = Catalog()
+    entities = {}
+    for key in range(300):
+        genres = rng.sample(GENRES, rng.randint(0, 8))
+        seeking = rng.random() < 0.8
+        catalog.put(key, ','.join(genres), 'San Francisco', 'CA', seeking)
+        entities[key] = (set(genres), seeking)
+    for _ in range(20):
+        genres = rng.sample(GENRES, rng.randint(1, len(GENRES)))
+        expected = {}
+        for key, (entity_genres, seeking) in entities.items():
+            shared = len(entity_genres & set(genres))
+            if seeking and shared:
+                expected[shared] = expected.get(shared, 0) | 1 << key
+        assert catalog.overlaps(genres) == expected
+
+
+def test_match_pages(client, add_artist, add_venue):
+    venue_id = add_venue('The Musical Hop', genres='Jazz,Blues', seeking_talent=True)
+    add_venue('Park Square Live Music & Coffee', genres='Jazz', city='New York', state='NY', seeking_talent=True)
+    add_venue('The Dueling Pianos Bar', genres='Classical', seeking_talent=True)
+    artist_id = add_artist('Guns N Petals', genres='Jazz', seeking_venue=True)
+    add_artist('Matt Quevedo', genres='Blues', seeking_venue=False)
+
+    page = client.get('/artists/%d/matches' % artist_id).get_data(as_text=True)
+    assert page.index('The Musical Hop') < page.index('Park Square Live Music &amp; Coffee')
+    assert 'The Dueling Pianos Bar' not in page
+
+    page = client.get('/venues/%d/matches' % venue_id).get_data(as_text=True)
+    assert 'Guns N Petals' in page and 'Matt Quevedo' not in page
+
+    # the limit is clamped to at least one match
+    page = client.get('/artists/%d/matches?limit=0' % artist_id).get_data(as_text=True)
+    assert 'The Musical Hop' in page and 'Park Square' not in page
+    assert client.get('/artists/%d/matches?limit=1000000' % artist_id).status_code == 200
+    assert client.get('/artists/999/matches').status_code == 404
+
+
+def test_one_reload_at_a_time_and_edits_survive_it(fyyur, add_artist, add_venue, monkeypatch):
+    add_artist('Guns N Petals', seeking_venue=True)
+    venue_id = add_venue('The Musical Hop', seeking_talent=True)
+    matchmaker = Matchmaker(ttl=0)
+    matchmaker.loaded_at = 0.0
+    matchmaker.put_venue(venue_id, 'Jazz', 'San Francisco', 'CA', True)
+
+    # hold the reload between reading the catalogs and counting shows
+    reading, release, reloads = threading.Event(), threading.Event(), []
+
+    def slow_window(now=None):
+        reloads.append(now)
+        reading.set()
+        release.wait(5)
+        return activity_window(now)
+    monkeypatch.setattr(matchmaking, 'activity_window', slow_window)
+
+    def reload():
+        with fyyur.app.app_context():
+            matchmaker.ensure_loaded(fyyur.db.session, Artist, Venue, Show)
+    thread = threading.Thread(target=reload)
+    thread.start()
+    assert reading.wait(5)
+
+    # meanwhile other requests rank from the catalogs as they were
+    matchmaker.ensure_loaded(fyyur.db.session, Artist, Venue, Show)
+    assert matchmaker.artists_for_venue(venue_id) == []
+    matchmaker.put_artist(99, 'Jazz', 'San Francisco', 'CA', True)
+    matchmaker.remove_venue(venue_id)
+
+    release.set()
+    thread.join(5)
+    assert len(reloads) == 1
+    assert sorted(matchmaker.artists.entities) == [1, 99]
+    assert matchmaker.venues.entities == {}
@@ -0,0 +1,105 @@
+import atexit
+import json
+import logging
+import math
+import sys
+
+from flask import Flask
+
+from metrics import Histogram, JsonFormatter, RequestMetrics, StructuredQueueHandler, setup_logging
+
+
+def make_app():
+    app = Flask(__name__)
+    metrics = RequestMetrics(app)
+
+    @app.route('/')
+    def index():
+        return 'ok'
+
+    return app, metrics
+
+
+def test_quantile_interpolates_inside_the_bucket():
+    histogram = Histogram(buckets=(1.0, 2.0, float('inf')))
+    for value in (0.5, 0.5, 1.5, 1.5):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(0.75) == 1.5
+    assert histogram.quantile(1.0) == 2.0
+
+
+def test_quantile_in_the_open_bucket_is_its_lower_bound():
+    histogram = Histogram(buckets=(1.0, 2.0, float('inf')))
+    histogram.observe(0.5)
+    histogram.observe(30.0)
+    assert histogram.quantile(0.99) == 2.0
+
+
+def test_quantile_without_observations():
+    assert math.isnan(Histogram().quantile(0.5))
+
+
+def test_exposition():
+    app, metrics = make_app()
+    client = app.test_client()
+    client.get('/')
+    client.get('/nope')
+    lines = metrics.exposition().splitlines()
+    assert '# TYPE fyyur_request_duration_seconds histogram' in lines
+    assert 'fyyur_request_duration_seconds_bucket{endpoint="index",method="GET",le="+Inf"} 1' in lines
+    assert 'fyyur_request_duration_seconds_count{endpoint="index",method="GET"} 1' in lines
+    assert 'fyyur_requests_total{endpoint="index",method="GET",status="200"} 1' in lines
+    assert 'fyyur_requests_total{endpoint="unmatched",method="GET",status="404"} 1' in lines
+    assert 'fyyur_requests_in_flight{endpoint="index"} 0' in lines
+    # buckets are cumulative
+    buckets = [int(line.rsplit(' ', 1)[1]) for line in lines
+               if line.startswith('fyyur_request_duration_seconds_bucket{endpoint="index"')]
+    assert buckets == sorted(buckets) and buckets[-1] == 1
+
+
+def test_unknown_methods_share_one_series():
+    app, metrics = make_app()
+    client = app.test_client()
+    for method in ('X0', 'X1', 'X2'):
+        client.open('/nope', method=method)
+    client.open('/nope', method='DELETE')
+    assert sorted(metrics.latency) == [('unmatched', 'DELETE'), ('unmatched', 'other')]
+    assert metrics.statuses[('unmatched', 'other', 404)] == 3
+
+
+def test_json_formatter():
+    try:
+        raise ValueError('bad')
+    except ValueError:
+        record = logging.LogRecord('fyyur', logging.ERROR, 'app.py', 12, 'failed %s', ('twice',), sys.exc_info())
+    record.fields = {'status': 500}
+    record = StructuredQueueHandler(None).prepare(record)
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry['message'] == 'failed twice'
+    assert entry['level'] == 'ERROR'
+    assert entry['where'] == 'app.py:12'
+    assert entry['status'] == 500
+    assert 'ValueError: bad' in entry['exception']
+
+
+def test_logs_are_written_by_the_listener(tmp_path):
+    app, _ = make_app()
+    app.config['ACCESS_LOG'] = str(tmp_path / 'access.log')
+    app.config['ERROR_LOG'] = str(tmp_path / 'error.log')
+    listener = setup_logging(app)
+    try:
+        app.test_client().get('/')
+        app.logger.error('boom %d', 1)
+    finally:
+        listener.stop()
+        atexit.unregister(listener.stop)
+        for logger in (app.logger, logging.getLogger('fyyur.access')):
+            for handler in list(logger.handlers):
+                if isinstance(handler, StructuredQueueHandler) and handler.queue is listener.queue:
+                    logger.removeHandler(handler)
+
+    access = [json.loads(line) for line in (tmp_path / 'access.log').read_text().splitlines()]
+    errors = [json.loads(line) for line in (tmp_path / 'error.log').read_text().splitlines()]
+    assert [(entry['method'], entry['path'], entry['status']) for entry in access] == [('GET', '/', 200)]
+    assert [entry['message'] for entry in errors] == ['boom 1']
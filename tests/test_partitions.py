@@ -0,0 +1,145 @@
+"""Runs `flask maintain-shows` against a real PostgreSQL.
+
+The partitioning DDL only exists on PostgreSQL, so these tests need a
+scratch database, given as FYYUR_TEST_POSTGRES_URI, e.g.
+
+    FYYUR_TEST_POSTGRES_URI=postgresql://postgres@localhost/fyyur_test python -m pytest tests
+
+Every table in that database is dropped. Without it the tests are skipped.
+"""
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from models import db
+from partitions import archive_cutoff, maintain_shows, month_start, next_month
+
+URI = os.environ.get('FYYUR_TEST_POSTGRES_URI')
+
+pytestmark = pytest.mark.skipif(not URI, reason='FYYUR_TEST_POSTGRES_URI is not set')
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine(URI)
+    with engine.begin() as connection:
+        connection.execute(text('DROP SCHEMA public CASCADE'))
+        connection.execute(text('CREATE SCHEMA public'))
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO venues (id, name, city, state, address, phone, image_link, seeking_talent) "
+            "VALUES (1, 'V', 'San Francisco', 'CA', 'a', '1', 'http://x/v.png', false)"
+        ))
+        connection.execute(text(
+            "INSERT INTO artists (id, name, city, state, phone, image_link, seeking_venue) "
+            "VALUES (1, 'A', 'San Francisco', 'CA', '2', 'http://x/a.png', false)"
+        ))
+    yield engine
+    engine.dispose()
+
+
+def add_show(connection, table, start_time, id=None):
+    connection.execute(text(
+        'INSERT INTO %s (%sstart_time, artist_id, venue_id) VALUES (%s:start_time, 1, 1)'
+        % (table, 'id, ' if id else '', ':id, ' if id else '')
+    ), {'id': id, 'start_time': start_time})
+
+
+def rows(connection, table):
+    return sorted(connection.execute(text('SELECT id, start_time FROM %s' % table)).fetchall())
+
+
+def partitions(connection, table):
+    return sorted(name for (name,) in connection.execute(text(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'WHERE i.inhparent = to_regclass(:table)'
+    ), {'table': table}))
+
+
+def months_ago(months):
+    month = month_start(date.today())
+    for _ in range(months):
+        month = date(month.year - (month.month == 1), (month.month - 2) % 12 + 1, 1)
+    return datetime.combine(month, datetime.min.time()) + timedelta(days=3, hours=20)
+
+
+def test_partitions_and_archives(engine):
+    with engine.begin() as connection:
+        for months in (8, 6, 1, 0):
+            add_show(connection, 'shows', months_ago(months))
+        add_show(connection, 'shows', datetime.now() + timedelta(days=200))
+        last_id = max(id for id, _ in rows(connection, 'shows'))
+        # rows already archived row by row, one in a month `shows` also holds
+        add_show(connection, 'shows_archive', months_ago(12), id=100)
+        add_show(connection, 'shows_archive', months_ago(8), id=101)
+        everything = rows(connection, 'shows') + rows(connection, 'shows_archive')
+
+    summary = maintain_shows(engine, 90, 3)
+    assert summary.startswith('Created ')
+
+    cutoff = datetime.combine(archive_cutoff(90), datetime.min.time())
+    with engine.begin() as connection:
+        hot = rows(connection, 'shows')
+        archived = rows(connection, 'shows_archive')
+        assert sorted(hot + archived) == everything
+        assert all(start_time >= cutoff for _, start_time in hot)
+        assert all(start_time < cutoff for _, start_time in archived)
+        assert 'shows_archive_%s' % months_ago(8).strftime('%Y_%m') in partitions(connection, 'shows_archive')
+        # this month and the next three exist, later shows wait in the default
+        month = month_start(date.today())
+        for _ in range(4):
+            assert 'shows_%s' % month.strftime('%Y_%m') in partitions(connection, 'shows')
+            month = next_month(month)
+        assert 'shows_default' in partitions(connection, 'shows')
+        # the id sequence survived the table swap
+        add_show(connection, 'shows', datetime.now() + timedelta(days=1))
+        assert max(id for id, _ in rows(connection, 'shows')) == last_id + 1
+
+
+def test_maintenance_is_repeatable(engine):
+    with engine.begin() as connection:
+        add_show(connection, 'shows', months_ago(6))
+        add_show(connection, 'shows', datetime.now())
+    maintain_shows(engine, 90, 3)
+    with engine.begin() as connection:
+        before = rows(connection, 'shows'), rows(connection, 'shows_archive')
+    maintain_shows(engine, 90, 3)
+    with engine.begin() as connection:
+        assert (rows(connection, 'shows'), rows(connection, 'shows_archive')) == before
+
+
+def test_archiving_into_a_month_the_archive_already_has(engine):
+    # the archive got a partition for a month at setup because it already
+    # held rows from it, while `shows` still did too
+    with engine.begin() as connection:
+        add_show(connection, 'shows_archive', months_ago(5), id=100)
+        add_show(connection, 'shows', months_ago(5))
+        add_show(connection, 'shows', datetime.now())
+    maintain_shows(engine, 400, 3)
+    with engine.begin() as connection:
+        assert len(rows(connection, 'shows')) == 2
+    maintain_shows(engine, 90, 3)
+    with engine.begin() as connection:
+        assert len(rows(connection, 'shows_archive')) == 2
+        assert len(rows(connection, 'shows')) == 1
+
+
+def test_shows_listed_for_archived_months_are_archived(engine):
+    with engine.begin() as connection:
+        add_show(connection, 'shows', months_ago(6))
+        add_show(connection, 'shows', datetime.now())
+    maintain_shows(engine, 90, 3)
+    # listed later for a month already archived, and for one never partitioned
+    with engine.begin() as connection:
+        add_show(connection, 'shows', months_ago(6) + timedelta(days=1))
+        add_show(connection, 'shows', months_ago(30))
+        assert len(rows(connection, 'shows_default')) == 2
+    maintain_shows(engine, 90, 3)
+    with engine.begin() as connection:
+        assert rows(connection, 'shows_default') == []
+        assert len(rows(connection, 'shows')) == 1
+        assert len(rows(connection, 'shows_archive')) == 3
+        assert 'shows_archive_%s' % months_ago(30).strftime('%Y_%m') in partitions(connection, 'shows_archive')
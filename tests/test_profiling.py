@@ -0,0 +1,93 @@
+import os
+import time
+
+from flask import Flask
+
+import profiling
+from profiling import RequestProfiler
+
+
+def make_app(tmp_path, **config):
+    app = Flask(__name__)
+    app.config.update({'PROFILE_DIR': str(tmp_path), 'PROFILE_TOKEN': 'secret', **config})
+    profiler = RequestProfiler(app)
+
+    @app.route('/slow')
+    def slow():
+        deadline = time.perf_counter() + 0.03
+        while time.perf_counter() < deadline:
+            pass
+        return 'ok'
+
+    return app, profiler
+
+
+def profiles(tmp_path):
+    return sorted(name for name in os.listdir(tmp_path) if name.endswith('.folded'))
+
+
+def test_token_request_is_profiled(tmp_path):
+    app, _ = make_app(tmp_path)
+    response = app.test_client().get('/slow', headers={'X-Fyyur-Profile': 'secret'})
+    name = response.headers['X-Fyyur-Profile-File']
+    assert profiles(tmp_path) == [name]
+    assert name.endswith('-slow-%d.folded' % os.getpid())
+    lines = (tmp_path / name).read_text().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        assert int(count) >= 1
+    # folded stacks run root first, so the view is below whatever called it
+    assert any('slow (test_profiling.py' in line.rsplit(';', 1)[-1] for line in lines)
+
+
+def test_other_requests_are_not_profiled(tmp_path):
+    app, _ = make_app(tmp_path)
+    client = app.test_client()
+    assert 'X-Fyyur-Profile-File' not in client.get('/slow').headers
+    assert 'X-Fyyur-Profile-File' not in client.get('/slow', headers={'X-Fyyur-Profile': 'guess'}).headers
+    assert profiles(tmp_path) == []
+
+
+def test_no_token_configured(tmp_path):
+    app, _ = make_app(tmp_path, PROFILE_TOKEN=None)
+    app.test_client().get('/slow', headers={'X-Fyyur-Profile': ''})
+    assert profiles(tmp_path) == []
+
+
+def test_sampled_requests_are_not_told_the_file(tmp_path):
+    app, _ = make_app(tmp_path, PROFILE_SAMPLE_RATE=1.0)
+    response = app.test_client().get('/slow')
+    assert 'X-Fyyur-Profile-File' not in response.headers
+    assert len(profiles(tmp_path)) == 1
+
+
+def test_only_the_newest_are_kept(tmp_path):
+    app, _ = make_app(tmp_path, PROFILE_KEEP=2)
+    client = app.test_client()
+    names = []
+    for _ in range(4):
+        names.append(client.get('/slow', headers={'X-Fyyur-Profile': 'secret'}).headers['X-Fyyur-Profile-File'])
+        # distinct modification times, oldest first
+        for name in names:
+            path = tmp_path / name
+            if path.exists():
+                os.utime(path, (path.stat().st_atime, path.stat().st_mtime - 10))
+    assert profiles(tmp_path) == sorted(names[-2:])
+
+
+def test_prune_skips_profiles_removed_meanwhile(tmp_path, monkeypatch):
+    app, profiler = make_app(tmp_path, PROFILE_KEEP=1)
+
+    class Removed:
+        name = 'gone.folded'
+        path = str(tmp_path / 'gone.folded')
+
+        def stat(self):
+            raise FileNotFoundError(self.path)
+
+    (tmp_path / 'kept.folded').write_text('a 1\n')
+    scandir = os.scandir
+    monkeypatch.setattr(profiling.os, 'scandir', lambda directory: [Removed()] + list(scandir(directory)))
+    profiler._prune(str(tmp_path))
+    assert profiles(tmp_path) == ['kept.folded']
@@ -0,0 +1,154 @@
+import time
+
+from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from ratelimit import DEFAULT_CONCURRENCY_LIMITS, DEFAULT_RATE_LIMITS, AdmissionControl, MemoryBackend
+
+
+def test_burst_then_limited():
+    backend = MemoryBackend()
+    for _ in range(5):
+        assert backend.take(('write', 'a'), 1, 5, 100.0) == 0
+    assert backend.take(('write', 'a'), 1, 5, 100.0) == 1.0
+
+
+def test_refill_at_rate():
+    backend = MemoryBackend()
+    for _ in range(5):
+        backend.take(('write', 'a'), 1, 5, 100.0)
+    assert backend.take(('write', 'a'), 1, 5, 100.5) == 0.5
+    assert backend.take(('write', 'a'), 1, 5, 101.0) == 0
+    assert backend.take(('write', 'a'), 1, 5, 101.0) > 0
+
+
+def test_refill_capped_at_burst():
+    backend = MemoryBackend()
+    backend.take(('search', 'a'), 2, 3, 0.0)
+    for _ in range(3):
+        assert backend.take(('search', 'a'), 2, 3, 1000.0) == 0
+    assert backend.take(('search', 'a'), 2, 3, 1000.0) > 0
+
+
+def test_clients_and_classes_have_separate_buckets():
+    backend = MemoryBackend()
+    assert backend.take(('write', 'a'), 1, 1, 0.0) == 0
+    assert backend.take(('write', 'a'), 1, 1, 0.0) > 0
+    assert backend.take(('write', 'b'), 1, 1, 0.0) == 0
+    assert backend.take(('read', 'a'), 1, 1, 0.0) == 0
+
+
+def test_refilled_buckets_are_evicted():
+    backend = MemoryBackend()
+    backend.take(('write', 'a'), 1, 2, 0.0)
+    backend.take(('write', 'b'), 1, 2, 0.0)
+    backend.take(('write', 'c'), 1, 2, 10.0)
+    assert list(backend.buckets) == [('write', 'c')]
+
+
+def test_buckets_judged_by_their_own_class():
+    backend = MemoryBackend()
+    # a drained search bucket stays drained while write requests come and go
+    for _ in range(10):
+        backend.take(('search', 'a'), 2, 10, 0.0)
+    backend.take(('write', 'b'), 100, 1, 1.0)
+    assert ('search', 'a') in backend.buckets
+    assert backend.take(('search', 'a'), 2, 10, 1.0) == 0
+    assert backend.take(('search', 'a'), 2, 10, 1.0) == 0
+    assert backend.take(('search', 'a'), 2, 10, 1.0) > 0
+
+
+def test_least_recently_used_evicted_past_max_keys():
+    backend = MemoryBackend(max_keys=3)
+    for client in 'abcd':
+        backend.take(('write', client), 1, 5, 0.0)
+    assert list(backend.buckets) == [('write', 'b'), ('write', 'c'), ('write', 'd')]
+    backend.take(('write', 'b'), 1, 5, 0.0)
+    backend.take(('write', 'e'), 1, 5, 0.0)
+    assert list(backend.buckets) == [('write', 'd'), ('write', 'b'), ('write', 'e')]
+
+
+def test_take_cost_independent_of_clients():
+    backend = MemoryBackend(max_keys=100000)
+    for client in range(100000):
+        backend.take(('search', client), 2, 10, 0.0)
+    started = time.perf_counter()
+    for client in range(100000, 101000):
+        backend.take(('search', client), 2, 10, 0.0)
+    assert time.perf_counter() - started < 0.5
+    assert len(backend.buckets) == 100000
+
+
+def make_app(rate_limits, concurrency_limits):
+    app = Flask(__name__)
+    app.config['RATE_LIMITS'] = rate_limits
+    app.config['CONCURRENCY_LIMITS'] = concurrency_limits
+    AdmissionControl(app)
+
+    @app.route('/')
+    def index():
+        return 'ok'
+
+    @app.route('/other')
+    def other():
+        return 'ok'
+
+    return app
+
+
+def test_rate_limited_requests_get_retry_after():
+    client = make_app({'read': (0.25, 2)}, {}).test_client()
+    assert client.get('/').status_code == 200
+    assert client.get('/').status_code == 200
+    response = client.get('/')
+    assert response.status_code == 429
+    assert 3 <= int(response.headers['Retry-After']) <= 4
+
+
+def test_routes_of_a_class_have_separate_buckets():
+    client = make_app({'read': (0.25, 1)}, {}).test_client()
+    assert client.get('/').status_code == 200
+    assert client.get('/').status_code == 429
+    assert client.get('/other').status_code == 200
+
+
+def test_forwarded_for_ignored_without_trusted_proxies():
+    client = make_app({'read': (0.25, 1)}, {}).test_client()
+    assert client.get('/', headers={'X-Forwarded-For': '10.0.0.1'}).status_code == 200
+    assert client.get('/', headers={'X-Forwarded-For': '10.0.0.2'}).status_code == 429
+
+
+def test_forwarded_for_read_from_trusted_proxies():
+    app = make_app({'read': (0.25, 1)}, {})
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
+    client = app.test_client()
+    assert client.get('/', headers={'X-Forwarded-For': '10.0.0.1'}).status_code == 200
+    assert client.get('/', headers={'X-Forwarded-For': '10.0.0.1'}).status_code == 429
+    assert client.get('/', headers={'X-Forwarded-For': '10.0.0.2'}).status_code == 200
+
+
+def test_default_limits_are_the_configured_ones():
+    import config
+    assert config.RATE_LIMITS == DEFAULT_RATE_LIMITS
+    assert config.CONCURRENCY_LIMITS == DEFAULT_CONCURRENCY_LIMITS
+
+
+def test_shed_requests_get_retry_after():
+    app = make_app({}, {'read': 1})
+    app.extensions['admission_control'].semaphores['read'].acquire()
+    response = app.test_client().get('/')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_stats_need_the_admin_token():
+    app = make_app({}, {})
+    app.add_url_rule('/admin/limits', 'admission_stats', app.extensions['admission_control'].stats_view)
+    client = app.test_client()
+    assert client.get('/admin/limits').status_code == 404
+    app.config['ADMIN_TOKEN'] = 'secret'
+    assert client.get('/admin/limits').status_code == 404
+    assert client.get('/admin/limits', headers={'X-Fyyur-Admin': 'guess'}).status_code == 404
+    response = client.get('/admin/limits', headers={'X-Fyyur-Admin': 'secret'})
+    assert response.status_code == 200
+    assert response.get_json()['stats']['read']['admitted'] >= 1
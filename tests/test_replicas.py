@@ -0,0 +1,76 @@
+import time
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+from replicas import ReplicaRouter, RoutingSQLAlchemy
+
+
+def make_app(tmp_path, replica_uri):
+    primary = tmp_path / 'primary.db'
+    with create_engine('sqlite:///%s' % primary).begin() as connection:
+        connection.execute(text('CREATE TABLE venues (id INTEGER PRIMARY KEY, name TEXT)'))
+        connection.execute(text("INSERT INTO venues (name) VALUES ('The Musical Hop')"))
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///%s' % primary
+    app.config['SQLALCHEMY_REPLICA_URIS'] = [replica_uri]
+    app.config['REPLICA_HEALTH_CHECK_SECONDS'] = 3600
+    db = RoutingSQLAlchemy()
+    db.init_app(app)
+    router = ReplicaRouter(app)
+
+    @app.route('/venues')
+    def venues():
+        return ','.join(name for (name,) in db.session.execute(text('SELECT name FROM venues')))
+
+    @app.route('/missing')
+    def missing():
+        app.missing_calls += 1
+        return str(db.session.execute(text('SELECT * FROM missing')).all())
+
+    app.missing_calls = 0
+
+    return app, router
+
+
+def test_read_served_by_replica(tmp_path):
+    replica = tmp_path / 'replica.db'
+    with create_engine('sqlite:///%s' % replica).begin() as connection:
+        connection.execute(text('CREATE TABLE venues (id INTEGER PRIMARY KEY, name TEXT)'))
+        connection.execute(text("INSERT INTO venues (name) VALUES ('Replica Hall')"))
+    app, _ = make_app(tmp_path, 'sqlite:///%s' % replica)
+    assert app.test_client().get('/venues').get_data(as_text=True) == 'Replica Hall'
+
+
+def test_unreachable_replica_falls_back_to_primary(tmp_path):
+    # went away after its last health check: no connection can be made
+    app, router = make_app(tmp_path, 'sqlite:///%s' % (tmp_path / 'gone' / 'replica.db'))
+    router.replicas[0].checked_at = time.monotonic()
+
+    response = app.test_client().get('/venues')
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == 'The Musical Hop'
+    assert not router.replicas[0].is_healthy()
+    # and the next read goes straight to the primary
+    assert app.test_client().get('/venues').get_data(as_text=True) == 'The Musical Hop'
+
+
+def test_primary_errors_are_not_retried(tmp_path):
+    app, router = make_app(tmp_path, 'sqlite:///%s' % (tmp_path / 'replica.db'))
+    router.replicas = []
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    assert app.test_client().get('/missing').status_code == 500
+
+
+def test_query_errors_leave_the_replica_healthy(tmp_path):
+    replica = tmp_path / 'replica.db'
+    with create_engine('sqlite:///%s' % replica).begin() as connection:
+        connection.execute(text('CREATE TABLE venues (id INTEGER PRIMARY KEY, name TEXT)'))
+    app, router = make_app(tmp_path, 'sqlite:///%s' % replica)
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    assert app.test_client().get('/missing').status_code == 500
+    # not retried on the primary, and the replica keeps serving
+    assert app.missing_calls == 1
+    assert router.replicas[0].is_healthy()
+    assert app.test_client().get('/venues').status_code == 200
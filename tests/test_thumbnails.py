@@ -0,0 +1,161 @@
+import http.server
+import os
+import threading
+
+import pytest
+from PIL import Image as PILImage
+
+import thumbnails
+from thumbnails import FetchError, HttpFetcher, is_public_address
+
+
+@pytest.mark.parametrize('address', [
+    '127.0.0.1', '10.0.0.5', '172.16.3.4', '192.168.1.1', '169.254.169.254', '0.0.0.0',
+    '::1', 'fe80::1%eth0', 'fd00::1', '::ffff:127.0.0.1', '::ffff:169.254.169.254',
+])
+def test_internal_addresses_are_not_public(address):
+    assert not is_public_address(address)
+
+
+@pytest.mark.parametrize('address', ['93.184.216.34', '8.8.8.8', '2606:4700:4700::1111'])
+def test_internet_addresses_are_public(address):
+    assert is_public_address(address)
+
+
+def serve(host, handler):
+    server = http.server.HTTPServer((host, 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Image(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'image')
+
+    def log_message(self, *args):
+        pass
+
+
+def test_refuses_loopback():
+    server = serve('127.0.0.1', Image)
+    try:
+        with pytest.raises(FetchError, match='non-public'):
+            HttpFetcher()('http://127.0.0.1:%d/i.png' % server.server_port)
+    finally:
+        server.shutdown()
+
+
+def test_refuses_redirect_to_internal_address(monkeypatch):
+    # 127.0.0.1 stands in for a public host here, 127.0.0.2 for an internal one
+    monkeypatch.setattr(thumbnails, 'is_public_address', lambda address: address == '127.0.0.1')
+    internal = serve('127.0.0.2', Image)
+
+    class Redirect(Image):
+        def do_GET(self):
+            self.send_response(302)
+            self.send_header('Location', 'http://127.0.0.2:%d/secret' % internal.server_port)
+            self.end_headers()
+
+    public = serve('127.0.0.1', Redirect)
+    image = serve('127.0.0.1', Image)
+    try:
+        assert HttpFetcher()('http://127.0.0.1:%d/i.png' % image.server_port) == b'image'
+        with pytest.raises(FetchError, match='non-public'):
+            HttpFetcher()('http://127.0.0.1:%d/i.png' % public.server_port)
+    finally:
+        for server in (public, image, internal):
+            server.shutdown()
+
+
+def source_image(tmp_path):
+    path = tmp_path / 'source.png'
+    PILImage.new('RGB', (800, 600), 'red').save(path)
+    return str(path)
+
+
+def test_workers_share_one_cache_directory(tmp_path):
+    fetcher = thumbnails.FileFetcher(source_image(tmp_path))
+    directory = str(tmp_path / 'cache')
+    worker_a = thumbnails.ThumbnailCache(directory, 10 ** 6, fetcher=fetcher)
+    worker_b = thumbnails.ThumbnailCache(directory, 10 ** 6, fetcher=fetcher)
+
+    path = worker_a.get('http://example.com/a.png', 'tile')
+    assert worker_b.cached('http://example.com/a.png', 'tile')
+    assert worker_b.get('http://example.com/a.png', 'tile') == path
+
+    # a file removed by another worker is rendered again rather than served missing
+    os.remove(path)
+    assert not worker_b.cached('http://example.com/a.png', 'tile')
+    assert os.path.exists(worker_b.get('http://example.com/a.png', 'tile'))
+
+
+def test_budget_applies_across_workers(tmp_path):
+    fetcher = thumbnails.FileFetcher(source_image(tmp_path))
+    directory = str(tmp_path / 'cache')
+    probe = thumbnails.ThumbnailCache(directory, 10 ** 9, fetcher=fetcher)
+    probe.get('http://example.com/probe.png', 'tile')
+    per_source = sum(entry.stat().st_size for entry in os.scandir(directory))
+    for entry in os.scandir(directory):
+        os.remove(entry.path)
+
+    # room for two sources' thumbnails in total, shared by two workers
+    workers = [thumbnails.ThumbnailCache(directory, 2 * per_source, fetcher=fetcher) for _ in range(2)]
+    for i in range(6):
+        path = workers[i % 2].get('http://example.com/%d.png' % i, 'tile')
+        os.utime(path, (i, i))
+        for name in workers[0].sizes:
+            os.utime(workers[0].path('http://example.com/%d.png' % i, name), (i, i))
+    assert sum(entry.stat().st_size for entry in os.scandir(directory)) <= 2 * per_source
+    assert workers[0].cached('http://example.com/5.png', 'tile')
+    assert not workers[1].cached('http://example.com/0.png', 'tile')
+
+
+def test_failed_fetches_are_not_retried_at_once(tmp_path, monkeypatch):
+    calls = []
+
+    def fetcher(url):
+        calls.append(url)
+        raise FetchError('Could not fetch %s' % url)
+    now = [1000.0]
+    monkeypatch.setattr(thumbnails.time, 'monotonic', lambda: now[0])
+    cache = thumbnails.ThumbnailCache(str(tmp_path), 10 ** 6, fetcher=fetcher, failure_ttl=60)
+
+    for _ in range(3):
+        with pytest.raises(FetchError):
+            cache.get('http://example.com/gone.png', 'tile')
+    assert len(calls) == 1
+    now[0] += 61
+    with pytest.raises(FetchError):
+        cache.get('http://example.com/gone.png', 'tile')
+    assert len(calls) == 2
+
+
+def test_failures_remembered_are_bounded(tmp_path, monkeypatch):
+    def fetcher(url):
+        raise FetchError('Could not fetch %s' % url)
+    monkeypatch.setattr(thumbnails.ThumbnailCache, 'MAX_FAILURES', 3)
+    cache = thumbnails.ThumbnailCache(str(tmp_path), 10 ** 6, fetcher=fetcher)
+    for i in range(5):
+        with pytest.raises(FetchError):
+            cache.get('http://example.com/%d.png' % i, 'tile')
+    assert list(cache._failed) == ['http://example.com/%d.png' % i for i in (2, 3, 4)]
+
+
+@pytest.mark.parametrize('link, proxied', [
+    ('https://example.com/a.png', True),
+    ('http://example.com/a.png', True),
+    ('/static/img/default.png', False),
+    ('data:image/png;base64,iVBORw0KGgo=', False),
+    ('', False),
+    (None, False),
+])
+def test_thumbnail_url_only_proxies_http_links(fyyur, link, proxied):
+    with fyyur.app.test_request_context():
+        url = fyyur.thumbnail_url(link)
+    if proxied:
+        assert url.startswith('/thumbnails/')
+    else:
+        assert url == link
@@ -0,0 +1,43 @@
+from models import Show
+
+
+def text(response):
+    return response.get_data(as_text=True)
+
+
+def test_lines_that_fail_to_parse_are_reported_and_skipped(client, add_artist, add_venue):
+    artist_id = add_artist('Matt Quevedo')
+    venue_id = add_venue('The Musical Hop')
+    lines = [
+        '%d, 2035-04-01 20:00' % venue_id,
+        '',
+        'The Musical Hop, 2035-04-02 20:00',
+        '%d 2035-04-03 20:00' % venue_id,
+        '%d, 04/04/2035 8pm' % venue_id,
+        '%d, 2035-04-05 20:00+02:00' % venue_id,
+        '%d, 2035-04-06 21:30' % venue_id,
+    ]
+    page = text(client.post('/shows/create/tour', data={'artist_id': artist_id, 'shows': '\n'.join(lines)}))
+    assert '2 of 6 shows were successfully listed!' in page
+    for line_number in (3, 4, 5, 6):
+        assert 'Line %d: expected &#34;venue_id, YYYY-MM-DD HH:MM&#34;.' % line_number in page
+    assert sorted(show.start_time.day for show in Show.query) == [1, 6]
+
+
+def test_tours_over_the_cap_are_turned_away(fyyur, client, add_artist, add_venue):
+    artist_id = add_artist('Matt Quevedo')
+    venue_id = add_venue('The Musical Hop')
+    shows = '\n'.join('%d, 2035-04-01 20:%02d' % (venue_id, i % 60) for i in range(fyyur.TOUR_MAX_SHOWS + 1))
+    response = client.post('/shows/create/tour', data={'artist_id': artist_id, 'shows': shows})
+    assert response.status_code == 200
+    assert 'at most %d shows at once, this one has %d.' % (fyyur.TOUR_MAX_SHOWS, fyyur.TOUR_MAX_SHOWS + 1) in text(response)
+    assert Show.query.count() == 0
+
+    shows = '\n'.join(shows.splitlines()[:fyyur.TOUR_MAX_SHOWS])
+    page = text(client.post('/shows/create/tour', data={'artist_id': artist_id, 'shows': shows}))
+    assert '%d of %d shows were successfully listed!' % (fyyur.TOUR_MAX_SHOWS, fyyur.TOUR_MAX_SHOWS) in page
+    assert Show.query.count() == fyyur.TOUR_MAX_SHOWS
+
+
+def test_form_states_the_cap(fyyur, client):
+    assert 'Up to %d shows at once.' % fyyur.TOUR_MAX_SHOWS in text(client.get('/shows/create/tour'))
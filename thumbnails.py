@@ -0,0 +1,271 @@
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import threading
+import time
+import urllib.request
+
+from PIL import Image
+
+
+# Artist and venue images are hotlinked from third-party hosts at full size.
+# ThumbnailCache fetches each source image once, renders every one of its
+# sizes from it and keeps the results on local disk, evicting the least
+# recently served files once the cache outgrows its byte budget.
+
+DEFAULT_SIZES = {
+    'tile': (320, 320),
+    'detail': (640, 640),
+}
+
+
+class FetchError(Exception):
+    pass
+
+
+def is_public_address(address):
+    # refuses loopback, private, link-local (cloud metadata) and reserved
+    # ranges, including IPv4 addresses mapped into IPv6
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if getattr(ip, 'ipv4_mapped', None):
+        ip = ip.ipv4_mapped
+    return ip.is_global
+
+
+def connect_public(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """socket.create_connection, but only ever to public addresses.
+
+    The check is made on the resolved addresses actually connected to, so a
+    hostname resolving to an internal address is refused too.
+    """
+    host, port = address[:2]
+    error = None
+    for family, type_, proto, _, sockaddr in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+        if not is_public_address(sockaddr[0]):
+            error = FetchError('Refusing to fetch from non-public address %s' % sockaddr[0])
+            continue
+        sock = socket.socket(family, type_, proto)
+        try:
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or OSError('Could not resolve %s' % host)
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+def public_opener():
+    # built by hand rather than with build_opener, which would add file://,
+    # ftp:// and proxy handlers a redirect could reach around the check through
+    opener = urllib.request.OpenerDirector()
+    for handler in (PublicHTTPHandler(), PublicHTTPSHandler(), urllib.request.HTTPRedirectHandler(),
+                    urllib.request.HTTPDefaultErrorHandler(), urllib.request.HTTPErrorProcessor()):
+        opener.add_handler(handler)
+    return opener
+
+
+class HttpFetcher:
+    """Downloads source images over http(s), refusing anything too large, too slow or not public.
+
+    Every connection, redirects included, must go to a public address, so an
+    image_link can't point the server at its own network.
+    """
+
+    def __init__(self, timeout=5, max_bytes=10 * 1024 * 1024):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.opener = public_opener()
+
+    def __call__(self, url):
+        if not url.startswith(('http://', 'https://')):
+            raise FetchError('Unsupported image URL: %s' % url)
+        try:
+            request = urllib.request.Request(url, headers={'User-Agent': 'Fyyur thumbnailer'})
+            with self.opener.open(request, timeout=self.timeout) as response:
+                data = response.read(self.max_bytes + 1)
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            raise FetchError('Could not fetch %s: %s' % (url, e))
+        if len(data) > self.max_bytes:
+            raise FetchError('Image too large: %s' % url)
+        return data
+
+
+class FileFetcher:
+    """Serves one local image for every URL, for developing without network access."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, url):
+        try:
+            with open(self.path, 'rb') as f:
+                return f.read()
+        except OSError as e:
+            raise FetchError('Could not read %s: %s' % (self.path, e))
+
+
+def render_thumbnail(data, size):
+    image = Image.open(io.BytesIO(data))
+    image = image.convert('RGB')
+    image.thumbnail(size)
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=85, optimize=True)
+    return out.getvalue()
+
+
+class ThumbnailCache:
+    """Thumbnails on disk, shared by every worker pointed at the same directory.
+
+    The directory is the only state: serving a file bumps its mtime, and
+    after each fetch the directory is scanned and the least recently served
+    files are removed until it fits in `max_bytes`, whichever worker wrote
+    them. A source that can't be fetched isn't tried again by this worker
+    for `failure_ttl` seconds.
+    """
+
+    # failed sources remembered at most, oldest forgotten first
+    MAX_FAILURES = 1024
+
+    def __init__(self, directory, max_bytes, sizes=None, fetcher=None, failure_ttl=60):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sizes = sizes or DEFAULT_SIZES
+        self.fetcher = fetcher or HttpFetcher()
+        self.failure_ttl = failure_ttl
+        self._lock = threading.Lock()
+        self._fetching = {}
+        self._failed = {}
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def path(self, url, size):
+        return os.path.join(self.directory, '%s-%s.jpg' % (self.key(url), size))
+
+    def cached(self, url, size):
+        return os.path.exists(self.path(url, size))
+
+    @staticmethod
+    def _touch(path):
+        # marks the file most recently used, if it is still there
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def get(self, url, size):
+        """Returns the path of `url`'s thumbnail at `size`, fetching the source if needed.
+
+        Raises FetchError when the source can't be fetched or decoded.
+        """
+        path = self.path(url, size)
+        if self._touch(path):
+            return path
+        with self._lock:
+            failed_until = self._failed.get(url)
+            if failed_until is not None:
+                if time.monotonic() < failed_until:
+                    raise FetchError('Could not fetch %s recently, not retrying yet' % url)
+                del self._failed[url]
+            # only one request per worker fetches a given source, the others wait for it
+            pending = self._fetching.get(url)
+            if pending is None:
+                pending = self._fetching[url] = threading.Event()
+                fetching = True
+            else:
+                fetching = False
+
+        if not fetching:
+            pending.wait()
+            if self._touch(path):
+                return path
+            raise FetchError('Could not fetch %s' % url)
+
+        try:
+            data = self.fetcher(url)
+            for name, dimensions in self.sizes.items():
+                try:
+                    thumbnail = render_thumbnail(data, dimensions)
+                except (OSError, ValueError, Image.DecompressionBombError) as e:
+                    raise FetchError('Could not read image %s: %s' % (url, e))
+                self._store(self.path(url, name), thumbnail)
+        except FetchError:
+            self._remember_failure(url)
+            raise
+        finally:
+            with self._lock:
+                del self._fetching[url]
+            pending.set()
+        self._evict(keep=path)
+        return path
+
+    def _remember_failure(self, url):
+        with self._lock:
+            self._failed[url] = time.monotonic() + self.failure_ttl
+            while len(self._failed) > self.MAX_FAILURES:
+                del self._failed[next(iter(self._failed))]
+
+    def _store(self, path, data):
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _evict(self, keep):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.jpg') or entry.path == keep:
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # evicted by another worker meanwhile
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        try:
+            total = os.stat(keep).st_size + sum(size for _, size, _ in entries)
+        except FileNotFoundError:
+            total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size